@@ -4,31 +4,360 @@ Run with: python backend_sqlite.py
 Access at: http://localhost:8001
 """
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from collections import OrderedDict
 import httpx
+import numpy as np
+import asyncio
 import base64
 import os
+import time
 import sqlite3
 import json
 import hashlib
+import math
 import secrets
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 DB_PATH = os.getenv("DB_PATH", "./data.db")
+# Conexiuni de citire (fiecare pe thread-ul ei); scrierile folosesc o singură conexiune serializată
+DB_READ_CONNECTIONS = int(os.getenv("DB_READ_CONNECTIONS", "4"))
+# Profilul de stocare SQLite, aplicat pe fiecare conexiune (citire și scriere)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL").upper()
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes, 0 = dezactivat
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "-65536"))  # negativ = KiB, pozitiv = pagini
+DB_TEMP_STORE = os.getenv("DB_TEMP_STORE", "MEMORY").upper()
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))  # ms
+# Mentenanță periodică: checkpoint pentru WAL și PRAGMA optimize (secunde, 0 = dezactivat)
+DB_CHECKPOINT_INTERVAL = float(os.getenv("DB_CHECKPOINT_INTERVAL", "300"))
+DB_CHECKPOINT_MODE = os.getenv("DB_CHECKPOINT_MODE", "PASSIVE").upper()
+DB_OPTIMIZE_INTERVAL = float(os.getenv("DB_OPTIMIZE_INTERVAL", "3600"))
+
+# HTTP transport (pool de conexiuni partajat către API-urile marketplace)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1"
+
+try:
+    import h2  # noqa: F401 - necesar pentru httpx(http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Rate limiting per (platformă, credential): cereri/secundă, burst și nivelul minim la care
+# coboară rata adaptivă când upstream-ul răspunde cu throttling (429/556)
+EMAG_RATE_LIMIT = float(os.getenv("EMAG_RATE_LIMIT", "3"))
+TRENDYOL_RATE_LIMIT = float(os.getenv("TRENDYOL_RATE_LIMIT", "5"))
+OBLIO_RATE_LIMIT = float(os.getenv("OBLIO_RATE_LIMIT", "5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "3"))
+RATE_LIMIT_MIN_RATE = float(os.getenv("RATE_LIMIT_MIN_RATE", "0.2"))
+# Retry cu backoff exponențial + jitter (respectă Retry-After)
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "30"))
+
+# Circuit breaker per (platformă, credential): după BREAKER_FAILURE_THRESHOLD eșecuri consecutive
+# cererile eșuează imediat timp de BREAKER_RESET_TIMEOUT secunde, apoi un număr mic de cereri de probă
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_HALF_OPEN_MAX_CALLS = int(os.getenv("BREAKER_HALF_OPEN_MAX_CALLS", "1"))
+
+# Câte cereri per-SKU rulează în paralel la verificarea stocurilor (1 = secvențial)
+EMAG_STOCK_CONCURRENCY = int(os.getenv("EMAG_STOCK_CONCURRENCY", "3"))
+TRENDYOL_STOCK_CONCURRENCY = int(os.getenv("TRENDYOL_STOCK_CONCURRENCY", "5"))
+
+# Index în memorie al ofertelor eMAG (un pull paginat în loc de o cerere per SKU)
+EMAG_OFFER_INDEX_ENABLED = os.getenv("EMAG_OFFER_INDEX_ENABLED", "1") == "1"
+EMAG_OFFER_INDEX_TTL = float(os.getenv("EMAG_OFFER_INDEX_TTL", "300"))
+EMAG_OFFER_INDEX_MAX_PAGES = int(os.getenv("EMAG_OFFER_INDEX_MAX_PAGES", "500"))
+# După un pull eșuat (timeout, 5xx, breaker deschis) indexul se reîncearcă după atâtea secunde
+EMAG_OFFER_INDEX_RETRY = float(os.getenv("EMAG_OFFER_INDEX_RETRY", "15"))
+
+# Paginarea comenzilor eMAG / Trendyol (pagini cerute în paralel)
+EMAG_ORDERS_CONCURRENCY = int(os.getenv("EMAG_ORDERS_CONCURRENCY", "4"))
+EMAG_ORDERS_MAX_PAGES = int(os.getenv("EMAG_ORDERS_MAX_PAGES", "100"))
+TRENDYOL_ORDERS_CONCURRENCY = int(os.getenv("TRENDYOL_ORDERS_CONCURRENCY", "4"))
+TRENDYOL_ORDERS_MAX_PAGES = int(os.getenv("TRENDYOL_ORDERS_MAX_PAGES", "100"))
+
+# Sync incremental Trendyol: doar pachetele modificate după watermark, cu reconciliere completă periodică
+TRENDYOL_INCREMENTAL_SYNC = os.getenv("TRENDYOL_INCREMENTAL_SYNC", "1") == "1"
+TRENDYOL_FULL_SYNC_INTERVAL = float(os.getenv("TRENDYOL_FULL_SYNC_INTERVAL", "21600"))  # secunde
+TRENDYOL_WATERMARK_OVERLAP = float(os.getenv("TRENDYOL_WATERMARK_OVERLAP", "300"))  # secunde
+# API-ul Trendyol acceptă intervale de maxim 2 săptămâni între startDate și endDate
+TRENDYOL_MAX_INCREMENTAL_WINDOW = 14 * 24 * 3600
+
+# Token-urile Oblio se pot salva în DB ca să nu fie cerute din nou după restart
+OBLIO_TOKEN_PERSIST = os.getenv("OBLIO_TOKEN_PERSIST", "0") == "1"
+
+# Câte pagini din nomenclatura Oblio sunt cerute în paralel la un pull complet
+OBLIO_PAGE_CONCURRENCY = int(os.getenv("OBLIO_PAGE_CONCURRENCY", "4"))
+
+# Snapshot-ul de stoc Oblio: proaspăt OBLIO_STOCK_TTL secunde, apoi servit învechit
+# (și reîmprospătat în fundal) încă OBLIO_STOCK_STALE_TTL secunde
+OBLIO_STOCK_TTL = float(os.getenv("OBLIO_STOCK_TTL", "60"))
+OBLIO_STOCK_STALE_TTL = float(os.getenv("OBLIO_STOCK_STALE_TTL", "600"))
+
+# Câte credențiale din aceeași platformă se sincronizează simultan (refresh-all și scheduler)
+EMAG_REFRESH_CONCURRENCY = int(os.getenv("EMAG_REFRESH_CONCURRENCY", "3"))
+TRENDYOL_REFRESH_CONCURRENCY = int(os.getenv("TRENDYOL_REFRESH_CONCURRENCY", "2"))
+
+# Sync automat în fundal: fiecare credential cu comenzi la SYNC_INTERVAL secunde (± SYNC_JITTER),
+# sărind peste cele sincronizate (manual sau automat) în ultimele SYNC_MIN_AGE secunde
+SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "1") == "1"
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "300"))
+SYNC_JITTER = float(os.getenv("SYNC_JITTER", "0.2"))  # fracțiune din interval
+SYNC_MIN_AGE = float(os.getenv("SYNC_MIN_AGE", "120"))
+SYNC_STARTUP_DELAY = float(os.getenv("SYNC_STARTUP_DELAY", "10"))
+
+# Statusurile comenzilor afișate ca active
+# EMAG: "new" (1) și "in progress" (2)
+# Trendyol: "new" (Created), "processing" (Picking), "invoiced" (Invoiced)
+ACTIVE_ORDER_STATUSES = ['new', 'in progress', 'processing', 'invoiced']
+
+
+def is_active_status(status):
+    """Statusul unei comenzi este activ? (se salvează în orders.is_active la fiecare sync)"""
+    return (status or "").lower() in ACTIVE_ORDER_STATUSES
+
+# Cache de snapshot-uri de ofertă eMAG per (credential, part_number)
+EMAG_OFFER_CACHE_TTL = float(os.getenv("EMAG_OFFER_CACHE_TTL", "60"))
+EMAG_OFFER_CACHE_SIZE = int(os.getenv("EMAG_OFFER_CACHE_SIZE", "5000"))
 
 # Database setup
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-conn.row_factory = sqlite3.Row
+class QueryResult:
+    """Rezultatul unei interogări, cu rândurile deja citite pe thread-ul bazei de date"""
+
+    def __init__(self, rows, rowcount=-1, lastrowid=None):
+        self.rows = rows
+        self.rowcount = rowcount
+        self.lastrowid = lastrowid
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class StorageProfile:
+    """PRAGMA-urile aplicate pe fiecare conexiune SQLite (implicit din variabilele DB_*)"""
+
+    JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+    SYNCHRONOUS_LEVELS = ["OFF", "NORMAL", "FULL", "EXTRA"]
+    TEMP_STORES = ["DEFAULT", "FILE", "MEMORY"]
+    CHECKPOINT_MODES = {"PASSIVE", "FULL", "RESTART", "TRUNCATE"}
+
+    def __init__(self, journal_mode="WAL", synchronous="NORMAL", mmap_size=0, cache_size=-2000,
+                 temp_store="DEFAULT", busy_timeout=5000):
+        # Valorile ajung direct în textul PRAGMA, deci le validăm la pornire
+        if journal_mode not in self.JOURNAL_MODES:
+            raise ValueError(f"Invalid DB_JOURNAL_MODE: {journal_mode}")
+        if synchronous not in self.SYNCHRONOUS_LEVELS:
+            raise ValueError(f"Invalid DB_SYNCHRONOUS: {synchronous}")
+        if temp_store not in self.TEMP_STORES:
+            raise ValueError(f"Invalid DB_TEMP_STORE: {temp_store}")
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size = int(mmap_size)
+        self.cache_size = int(cache_size)
+        self.temp_store = temp_store
+        self.busy_timeout = int(busy_timeout)
+
+    def apply(self, connection):
+        connection.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+        connection.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        connection.execute(f"PRAGMA cache_size = {self.cache_size}")
+        connection.execute(f"PRAGMA temp_store = {self.temp_store}")
+
+    @classmethod
+    def active(cls, connection):
+        """Valorile efective pe o conexiune (SQLite poate refuza unele, ex. WAL pe :memory:)"""
+        def pragma(name):
+            return connection.execute(f"PRAGMA {name}").fetchone()[0]
+
+        synchronous = pragma("synchronous")
+        temp_store = pragma("temp_store")
+        return {
+            "journal_mode": str(pragma("journal_mode")).upper(),
+            "synchronous": cls.SYNCHRONOUS_LEVELS[synchronous] if 0 <= synchronous < 4 else synchronous,
+            "mmap_size": pragma("mmap_size"),
+            "cache_size": pragma("cache_size"),
+            "temp_store": cls.TEMP_STORES[temp_store] if 0 <= temp_store < 3 else temp_store,
+            "busy_timeout": pragma("busy_timeout"),
+        }
+
+
+class Database:
+    """
+    Acces SQLite în afara event loop-ului. Citirile rulează pe un pool de DB_READ_CONNECTIONS
+    thread-uri, fiecare cu conexiunea lui; scrierile rulează pe un singur thread cu o singură
+    conexiune, deci sunt serializate și nu se blochează reciproc. Cu WAL, citirile nu mai
+    așteaptă după tranzacția de scriere a unui refresh.
+    """
+
+    def __init__(self, path, readers=4, profile=None):
+        self.path = path
+        self.profile = profile or StorageProfile()
+        self.writer = self._connect()
+        self._local = threading.local()
+        self._read_pool = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="db-read")
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        self._maintenance_task = None
+        self.last_checkpoint = None
+        self.last_optimize = None
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, check_same_thread=False, timeout=self.profile.busy_timeout / 1000
+        )
+        connection.row_factory = sqlite3.Row
+        self.profile.apply(connection)
+        return connection
+
+    def _reader(self):
+        connection = getattr(self._local, "conn", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.conn = connection
+        return connection
+
+    async def read(self, fn, *args):
+        """Rulează fn(conn, *args) pe o conexiune de citire"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_pool, lambda: fn(self._reader(), *args))
+
+    async def write(self, fn, *args):
+        """Rulează fn(conn, *args) pe conexiunea de scriere, într-o tranzacție explicită (commit / rollback)"""
+        def run(c):
+            c.execute("BEGIN")
+            try:
+                result = fn(c, *args)
+                c.commit()
+                return result
+            except BaseException:
+                c.rollback()
+                raise
+
+        return await self._on_writer(run)
+
+    async def _on_writer(self, fn):
+        """fn(conn) pe thread-ul de scriere, fără tranzacție (PRAGMA-uri care nu pot rula într-una)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_pool, lambda: fn(self.writer))
+
+    async def query(self, sql, params=()):
+        """SELECT pe o conexiune de citire"""
+        return await self.read(lambda c: QueryResult(c.execute(sql, params).fetchall()))
+
+    async def execute(self, sql, params=()):
+        """O singură instrucțiune de scriere, cu commit"""
+        def run(c):
+            cur = c.execute(sql, params)
+            return QueryResult(cur.fetchall(), cur.rowcount, cur.lastrowid)
+
+        return await self.write(run)
+
+    async def active_profile(self):
+        """PRAGMA-urile efective, citite de pe o conexiune de citire (pentru /health)"""
+        return await self.read(StorageProfile.active)
+
+    async def checkpoint(self, mode="PASSIVE"):
+        """Mută paginile din WAL în fișierul bazei ca WAL-ul să nu crească nelimitat"""
+        if mode not in StorageProfile.CHECKPOINT_MODES:
+            raise ValueError(f"Invalid checkpoint mode: {mode}")
+
+        def run(c):
+            busy, log_pages, checkpointed = c.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+            return {"busy": busy, "log_pages": log_pages, "checkpointed": checkpointed}
 
+        result = await self._on_writer(run)
+        self.last_checkpoint = {**result, "mode": mode, "at": datetime.now().isoformat()}
+        return result
 
-def init_db():
+    async def optimize(self):
+        """PRAGMA optimize: actualizează statisticile planner-ului unde e nevoie"""
+        await self._on_writer(lambda c: c.execute("PRAGMA optimize"))
+        self.last_optimize = datetime.now().isoformat()
+
+    def start_maintenance(self, checkpoint_interval, optimize_interval, checkpoint_mode="PASSIVE"):
+        if checkpoint_mode not in StorageProfile.CHECKPOINT_MODES:
+            raise ValueError(f"Invalid DB_CHECKPOINT_MODE: {checkpoint_mode}")
+        if self._maintenance_task is None and (checkpoint_interval > 0 or optimize_interval > 0):
+            self._maintenance_task = asyncio.create_task(
+                self._maintenance_loop(checkpoint_interval, optimize_interval, checkpoint_mode)
+            )
+
+    async def stop_maintenance(self):
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+
+    async def _maintenance_loop(self, checkpoint_interval, optimize_interval, checkpoint_mode):
+        loop = asyncio.get_running_loop()
+        next_checkpoint = loop.time() + checkpoint_interval if checkpoint_interval > 0 else None
+        next_optimize = loop.time() + optimize_interval if optimize_interval > 0 else None
+        while True:
+            due = min(t for t in (next_checkpoint, next_optimize) if t is not None)
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            now = loop.time()
+            try:
+                if next_checkpoint is not None and now >= next_checkpoint:
+                    next_checkpoint = now + checkpoint_interval
+                    if self.profile.journal_mode == "WAL":
+                        result = await self.checkpoint(checkpoint_mode)
+                        print(f"[DB] WAL checkpoint ({checkpoint_mode}): {result}")
+                if next_optimize is not None and now >= next_optimize:
+                    next_optimize = now + optimize_interval
+                    await self.optimize()
+                    print(f"[DB] PRAGMA optimize done")
+            except Exception as e:
+                print(f"[DB] Maintenance failed: {type(e).__name__}: {e}")
+
+    def maintenance_stats(self):
+        return {
+            "running": self._maintenance_task is not None,
+            "last_checkpoint": self.last_checkpoint,
+            "last_optimize": self.last_optimize,
+        }
+
+
+db = Database(
+    DB_PATH,
+    readers=DB_READ_CONNECTIONS,
+    profile=StorageProfile(
+        journal_mode=DB_JOURNAL_MODE,
+        synchronous=DB_SYNCHRONOUS,
+        mmap_size=DB_MMAP_SIZE,
+        cache_size=DB_CACHE_SIZE,
+        temp_store=DB_TEMP_STORE,
+        busy_timeout=DB_BUSY_TIMEOUT,
+    ),
+)
+
+
+def init_db(conn):
     cur = conn.cursor()
     cur.execute(
         """
@@ -85,16 +414,487 @@ def init_db():
         );
         """
     )
-    # Add new columns if they don't exist (for existing databases)
-    try:
-        conn.execute("ALTER TABLE calculator_products ADD COLUMN marketplace_settings TEXT")
-    except:
-        pass  # Column already exists
-    try:
-        conn.execute("ALTER TABLE calculator_products ADD COLUMN manual_products TEXT")
-    except:
-        pass  # Column already exists
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS oblio_tokens (
+            token_key TEXT PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """
+    )
+    conn.commit()
+    # Coloanele și indexurile adăugate ulterior vin din migrații versionate
+    run_migrations(conn)
+
+
+def _add_column(conn, table, column, decl):
+    """ALTER TABLE ADD COLUMN doar dacă lipsește (bazele de dinainte de migrații o pot avea deja)"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _migrate_calculator_settings(conn):
+    _add_column(conn, "calculator_products", "marketplace_settings", "TEXT")
+    _add_column(conn, "calculator_products", "manual_products", "TEXT")
+
+
+def _migrate_trendyol_watermark(conn):
+    _add_column(conn, "credentials", "sync_watermark", "INTEGER")
+    _add_column(conn, "credentials", "last_full_sync", "TEXT")
+
+
+def _migrate_sync_status(conn):
+    _add_column(conn, "credentials", "sync_status", "TEXT")
+    _add_column(conn, "credentials", "sync_error", "TEXT")
+
+
+def _migrate_hot_query_indexes(conn):
+    # GET /orders (cu și fără credential_id), ordonat după created_at
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_credential_created ON orders(user_id, credential_id, created_at)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)")
+    # Căutarea credențialelor unui user după platformă (stocuri, prețuri, refresh-all)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_credentials_user_platform ON credentials(user_id, platform)")
+
+
+def _migrate_active_flag(conn):
+    # Statusul activ/inactiv normalizat într-o coloană indexată: /orders citește doar comenzile active
+    _add_column(conn, "orders", "is_active", "INTEGER NOT NULL DEFAULT 0")
+    placeholders = ",".join("?" * len(ACTIVE_ORDER_STATUSES))
+    conn.execute(
+        f"UPDATE orders SET is_active = (lower(COALESCE(status, '')) IN ({placeholders}))",
+        ACTIVE_ORDER_STATUSES,
+    )
+    # Indexurile din migrația 4 sunt înlocuite de variantele care includ is_active
+    conn.execute("DROP INDEX IF EXISTS idx_orders_user_credential_created")
+    conn.execute("DROP INDEX IF EXISTS idx_orders_user_created")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_credential_active_created "
+        "ON orders(user_id, credential_id, is_active, created_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_active_created ON orders(user_id, is_active, created_at)"
+    )
+
+
+def _migrate_order_items(conn):
+    # Liniile comenzilor, normalizate din blob-ul JSON orders.items.
+    # qty și price nu au tip declarat ca să păstreze exact tipul primit de la API (int / float / text).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id TEXT NOT NULL,
+            line_no INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            credential_id INTEGER NOT NULL,
+            sku TEXT,
+            name TEXT,
+            qty,
+            price,
+            PRIMARY KEY (order_id, line_no),
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+        """
+    )
+    # Cheia primară acoperă căutarea după order_id; indexul după SKU servește agregările
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_items_user_sku ON order_items(user_id, sku)")
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO order_items (order_id, line_no, user_id, credential_id, sku, name, qty, price)
+        SELECT o.id, CAST(j.key AS INTEGER), o.user_id, o.credential_id,
+               json_extract(j.value, '$.sku'), json_extract(j.value, '$.name'),
+               json_extract(j.value, '$.qty'), json_extract(j.value, '$.price')
+        FROM orders o, json_each(o.items) j
+        WHERE o.items IS NOT NULL AND json_valid(o.items)
+        """
+    )
+    conn.execute("UPDATE orders SET items = NULL")
+
+
+def _migrate_keyset_indexes(conn):
+    # Paginarea keyset pe (created_at, id) are nevoie de id în index, altfel departajarea cere sortare
+    conn.execute("DROP INDEX IF EXISTS idx_orders_user_credential_active_created")
+    conn.execute("DROP INDEX IF EXISTS idx_orders_user_active_created")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_credential_active_created_id "
+        "ON orders(user_id, credential_id, is_active, created_at, id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_active_created_id ON orders(user_id, is_active, created_at, id)"
+    )
+
+
+def apply_sku_demand(conn, sign, order_filter, params=()):
+    """
+    Adaugă (sign=1) sau scade (sign=-1) în sku_demand cantitățile din liniile comenzilor active
+    care respectă order_filter (condiție SQL pe alias-ul o = orders).
+    """
+    conn.execute(
+        f"""
+        INSERT INTO sku_demand (user_id, credential_id, vendor_code, sku, qty, lines)
+        SELECT i.user_id, i.credential_id, COALESCE(o.vendor_code, ''), i.sku,
+               ? * SUM(COALESCE(CAST(i.qty AS REAL), 0)), ? * COUNT(*)
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        WHERE o.is_active = 1 AND i.sku IS NOT NULL AND {order_filter}
+        GROUP BY i.user_id, i.credential_id, COALESCE(o.vendor_code, ''), i.sku
+        ON CONFLICT(user_id, sku, credential_id, vendor_code) DO UPDATE SET
+            qty = qty + excluded.qty,
+            lines = lines + excluded.lines
+        """,
+        (sign, sign, *params),
+    )
+
+
+def _migrate_sku_demand(conn):
+    # Cererea în așteptare per SKU, actualizată incremental la fiecare sync (vezi apply_sku_demand)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sku_demand (
+            user_id INTEGER NOT NULL,
+            sku TEXT NOT NULL,
+            credential_id INTEGER NOT NULL,
+            vendor_code TEXT NOT NULL,
+            qty REAL NOT NULL DEFAULT 0,
+            lines INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, sku, credential_id, vendor_code)
+        )
+        """
+    )
+    conn.execute("DELETE FROM sku_demand")
+    apply_sku_demand(conn, 1, "1 = 1")
+
+
+CALCULATOR_SETTINGS = ("electricity_settings", "marketplace_settings", "manual_products")
+
+
+def calculator_product_key(product, position):
+    """Cheia rândului unui produs; produsele vechi fără key primesc una după poziție"""
+    key = product.get("key")
+    return str(key) if key not in (None, "") else f"_pos{position}"
+
+
+def _split_calculator_product(product):
+    """Separă produsul în (JSON fără părți, are listă de părți, [JSON per parte])"""
+    parts = product.get("parts")
+    has_parts = isinstance(parts, list)
+    data = json.dumps({k: v for k, v in product.items() if not (k == "parts" and has_parts)})
+    return data, int(has_parts), [json.dumps(part) for part in parts] if has_parts else []
+
+
+def load_calculator_rows(conn, user_id, keys=None):
+    """Rândurile curente ale produselor (toate sau doar keys), indexate după product_key"""
+    key_filter = ""
+    params = (user_id,)
+    if keys is not None:
+        key_filter = " AND product_key IN (SELECT value FROM json_each(?))"
+        params = (user_id, json.dumps(list(keys)))
+    rows = {
+        row["product_key"]: {
+            "position": row["position"],
+            "version": row["version"],
+            "data": row["data"],
+            "has_parts": row["has_parts"],
+            "parts": [],
+        }
+        for row in conn.execute(
+            "SELECT product_key, position, version, data, has_parts FROM calculator_items "
+            f"WHERE user_id = ?{key_filter}",
+            params,
+        )
+    }
+    for row in conn.execute(
+        f"SELECT product_key, data FROM calculator_parts WHERE user_id = ?{key_filter} ORDER BY product_key, part_no",
+        params,
+    ):
+        if row["product_key"] in rows:
+            rows[row["product_key"]]["parts"].append(row["data"])
+    return rows
+
+
+def load_calculator_products(conn, user_id):
+    """Reconstruiește lista de produse în ordinea position, plus versiunea fiecăruia"""
+    rows = load_calculator_rows(conn, user_id)
+    products = []
+    versions = {}
+    for key, row in sorted(rows.items(), key=lambda item: item[1]["position"]):
+        product = json.loads(row["data"])
+        if product.get("key") in (None, ""):
+            # Rânduri scrise înainte ca cheia generată să fie salvată în data
+            product["key"] = key
+        if row["has_parts"]:
+            product["parts"] = [json.loads(part) for part in row["parts"]]
+        products.append(product)
+        versions[key] = row["version"]
+    return products, versions
+
+
+def write_calculator_product(conn, user_id, key, product, position, current):
+    """
+    Scrie produsul și părțile lui doar dacă diferă de rândul curent (current, din load_calculator_rows).
+    Întoarce versiunea rezultată; versiunea crește doar când conținutul se schimbă.
+    """
+    if product.get("key") in (None, ""):
+        # Cheia generată (calculator_product_key) se salvează în produs, ca frontend-ul să o
+        # primească la GET și să o poată folosi în PATCH
+        product = {**product, "key": key}
+    data, has_parts, parts = _split_calculator_product(product)
+    if current and (current["data"], current["has_parts"], current["parts"]) == (data, has_parts, parts):
+        if current["position"] != position:
+            conn.execute(
+                "UPDATE calculator_items SET position = ? WHERE user_id = ? AND product_key = ?",
+                (position, user_id, key),
+            )
+        return current["version"]
+
+    version = current["version"] + 1 if current else 1
+    conn.execute(
+        """
+        INSERT INTO calculator_items (user_id, product_key, position, version, data, has_parts)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, product_key) DO UPDATE SET
+            position = excluded.position,
+            version = excluded.version,
+            data = excluded.data,
+            has_parts = excluded.has_parts
+        """,
+        (user_id, key, position, version, data, has_parts),
+    )
+    conn.execute("DELETE FROM calculator_parts WHERE user_id = ? AND product_key = ?", (user_id, key))
+    conn.executemany(
+        "INSERT INTO calculator_parts (user_id, product_key, part_no, data) VALUES (?, ?, ?, ?)",
+        [(user_id, key, part_no, part) for part_no, part in enumerate(parts)],
+    )
+    return version
+
+
+def delete_calculator_products(conn, user_id, keys):
+    params = (user_id, json.dumps(list(keys)))
+    for table in ("calculator_parts", "calculator_items"):
+        conn.execute(
+            f"DELETE FROM {table} WHERE user_id = ? AND product_key IN (SELECT value FROM json_each(?))",
+            params,
+        )
+
+
+def save_calculator_settings(conn, user_id, settings):
+    """Scrie doar setările primite (subset din CALCULATOR_SETTINGS); produsele stau în calculator_items"""
+    conn.execute(
+        "INSERT INTO calculator_products (user_id, products) VALUES (?, '[]') ON CONFLICT(user_id) DO NOTHING",
+        (user_id,),
+    )
+    for column in CALCULATOR_SETTINGS:
+        if column in settings:
+            conn.execute(
+                f"UPDATE calculator_products SET {column} = ? WHERE user_id = ?",
+                (json.dumps(settings[column]), user_id),
+            )
+
+
+def _migrate_calculator_rows(conn):
+    # Produsele calculatorului ca rânduri (un rând per produs + unul per parte), cu versiune pentru PATCH
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calculator_items (
+            user_id INTEGER NOT NULL,
+            product_key TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            data TEXT NOT NULL,
+            has_parts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, product_key),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS calculator_parts (
+            user_id INTEGER NOT NULL,
+            product_key TEXT NOT NULL,
+            part_no INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, product_key, part_no)
+        )
+        """
+    )
+    for row in conn.execute("SELECT user_id, products FROM calculator_products").fetchall():
+        try:
+            products = json.loads(row[1] or "[]")
+        except ValueError:
+            print(f"[DB] Skipping unreadable calculator products for user {row[0]}")
+            continue
+        if not isinstance(products, list):
+            print(f"[DB] Skipping calculator products for user {row[0]}: not a list")
+            continue
+        used = set()
+        skipped = 0
+        for position, product in enumerate(products):
+            if not isinstance(product, dict):
+                skipped += 1
+                continue
+            key = calculator_product_key(product, position)
+            if key in used:
+                # Cheie duplicată în blob: produsul primește o cheie proprie în loc să-l suprascrie pe primul
+                while key in used:
+                    key = f"{key}_pos{position}"
+                print(f"[DB] Duplicate calculator product key for user {row[0]} at position {position}, stored as {key}")
+                product = {**product, "key": key}
+            used.add(key)
+            write_calculator_product(conn, row[0], key, product, position, None)
+        if skipped:
+            # Blob-ul rămâne neatins ca să nu se piardă intrările care nu sunt produse
+            print(f"[DB] Keeping calculator products blob for user {row[0]}: {skipped} non-object entries")
+            continue
+        # Blob-ul se golește doar după ce toate produsele lui au fost scrise ca rânduri
+        conn.execute("UPDATE calculator_products SET products = '[]' WHERE user_id = ?", (row[0],))
+
+
+# (versiune, descriere, funcție) - se aplică în ordine, fiecare într-o tranzacție proprie.
+# Migrațiile noi se adaugă doar la final, cu versiunea următoare.
+MIGRATIONS = [
+    (1, "calculator_products: marketplace_settings, manual_products", _migrate_calculator_settings),
+    (2, "credentials: Trendyol sync watermark", _migrate_trendyol_watermark),
+    (3, "credentials: sync_status, sync_error", _migrate_sync_status),
+    (4, "indexes for orders and credentials lookups", _migrate_hot_query_indexes),
+    (5, "orders.is_active with active-order indexes", _migrate_active_flag),
+    (6, "order_items table (moved from the orders.items JSON)", _migrate_order_items),
+    (7, "orders keyset pagination indexes (created_at, id)", _migrate_keyset_indexes),
+    (8, "sku_demand summary table", _migrate_sku_demand),
+    (9, "calculator_items / calculator_parts (moved from the products JSON)", _migrate_calculator_rows),
+]
+
+
+def schema_version(conn):
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def run_migrations(conn):
+    """Aplică migrațiile cu versiune mai mare decât cea din schema_version"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
     conn.commit()
+    current = schema_version(conn)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"[DB] Applying migration {version}: {description}")
+        try:
+            conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat()),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"[DB] Migration {version} failed")
+            raise
+
+
+# Interogările frecvente și parametri de exemplu - trebuie să folosească un index (fără SCAN / sortare
+# în B-tree temporar). Verificate cu: python backend_sqlite.py --check-query-plans
+HOT_QUERIES = [
+    (
+        "active orders by user",
+        "SELECT * FROM orders WHERE user_id = ? AND is_active = 1 ORDER BY created_at DESC, id DESC LIMIT 50",
+        (1,),
+    ),
+    (
+        "active orders by user and credential",
+        "SELECT * FROM orders WHERE user_id = ? AND credential_id = ? AND is_active = 1 "
+        "ORDER BY created_at DESC, id DESC LIMIT 50",
+        (1, 1),
+    ),
+    (
+        "active orders page after a cursor",
+        "SELECT * FROM orders WHERE user_id = ? AND is_active = 1 AND (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT 50",
+        (1, "2024-01-01", "1-1"),
+        "(created_at,id)<(?,?)",
+    ),
+    (
+        "active orders page after a cursor, by credential",
+        "SELECT * FROM orders WHERE user_id = ? AND credential_id = ? AND is_active = 1 AND (created_at, id) < (?, ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT 50",
+        (1, 1, "2024-01-01", "1-1"),
+        "(created_at,id)<(?,?)",
+    ),
+    (
+        "active orders without a date after a cursor",
+        "SELECT * FROM orders WHERE user_id = ? AND is_active = 1 AND created_at IS NULL AND id < ? "
+        "ORDER BY created_at DESC, id DESC LIMIT 50",
+        (1, "1-1"),
+        "id<?",
+    ),
+    (
+        "active orders count",
+        "SELECT COUNT(*) FROM orders WHERE user_id = ? AND is_active = 1",
+        (1,),
+    ),
+    (
+        "credentials by user and platform",
+        "SELECT * FROM credentials WHERE user_id = ? AND platform = ?",
+        (1, 1),
+    ),
+    (
+        "pending demand by user",
+        "SELECT sku, credential_id, vendor_code, qty FROM sku_demand WHERE user_id = ? ORDER BY sku",
+        (1,),
+    ),
+    (
+        "order lines by user and SKU",
+        "SELECT order_id, qty FROM order_items WHERE user_id = ? AND sku = ?",
+        (1, "SKU"),
+    ),
+    (
+        "order lines of an order",
+        "SELECT * FROM order_items WHERE order_id = ? ORDER BY line_no",
+        ("1-1",),
+    ),
+    (
+        "calculator parts by user",
+        "SELECT product_key, data FROM calculator_parts WHERE user_id = ? ORDER BY product_key, part_no",
+        (1,),
+    ),
+    (
+        "calculator products by key",
+        "SELECT product_key, version FROM calculator_items "
+        "WHERE user_id = ? AND product_key IN (SELECT value FROM json_each(?))",
+        (1, '["1"]'),
+    ),
+]
+
+
+def check_query_plans(conn, queries=None):
+    """
+    Rulează EXPLAIN QUERY PLAN pe interogările frecvente și returnează problemele găsite
+    (listă goală = toate folosesc indexuri).
+    Un al patrulea element opțional este termenul care trebuie să apară în plan (ex. intervalul
+    de seek al cursorului): fără el indexul e folosit doar pe prefix și restul se parcurge rând cu rând.
+    """
+    problems = []
+    for name, sql, params, *required in queries or HOT_QUERIES:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        for term in required:
+            if not any(term in detail for detail in plan):
+                problems.append(f"{name}: index range does not use {term} (plan: {'; '.join(plan)})")
+        for detail in plan:
+            # SCAN pe json_each parcurge doar lista de parametri, nu un tabel
+            if (detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail) or "USE TEMP B-TREE" in detail:
+                problems.append(f"{name}: {detail} (plan: {'; '.join(plan)})")
+    return problems
 
 
 def row_to_dict(row):
@@ -117,303 +917,991 @@ def verify_password(password: str, hash_str: str) -> bool:
         return False
 
 
-init_db()
+init_db(db.writer)
 
-app = FastAPI(title="Marketplace Admin API")
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Hosturile upstream cunoscute - clienții lor sunt creați la pornire
+UPSTREAM_BASE_URLS = [
+    "https://marketplace-api.emag.ro",
+    "https://marketplace-api.emag.hu",
+    "https://marketplace-api.emag.bg",
+    "https://apigw.trendyol.com",
+    "https://www.oblio.eu",
+]
 
-# Models
-class Order(BaseModel):
-    id: str
-    platform_order_id: str
-    status: str
-    order_type: int
-    vendor_code: str
-    created_at: str
-    items: List[dict] = []
 
+class HTTPTransport:
+    """
+    Un httpx.AsyncClient pooled pentru fiecare host upstream (keep-alive, HTTP/2 unde e suportat).
+    Este partajat de EMAGClient, TrendyolClient și OblioClient pe toată durata aplicației.
+    """
 
-class Credential(BaseModel):
-    id: int
-    account_label: str
-    platform: str
-    client_id: str
-    vendor_code: str
-    last_sync: Optional[str] = None
+    def __init__(self):
+        self._clients = {}
 
+    def _new_client(self):
+        return httpx.AsyncClient(
+            http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
 
-class LoginRequest(BaseModel):
-    email: str
-    password: str
+    def client_for(self, url):
+        """Returnează clientul pooled pentru host-ul URL-ului (îl creează la nevoie)"""
+        parsed = httpx.URL(url)
+        key = (parsed.scheme, parsed.host, parsed.port)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = self._new_client()
+            self._clients[key] = client
+        return client
 
+    async def request(self, method, url, **kwargs):
+        return await self.client_for(url).request(method, url, **kwargs)
 
-class SignupRequest(BaseModel):
-    email: str
-    password: str
-    name: str
+    def start(self):
+        for base_url in UPSTREAM_BASE_URLS:
+            self.client_for(base_url)
+        print(
+            f"[HTTP] Transport started: {len(self._clients)} host pools, "
+            f"http2={HTTP2_ENABLED and HTTP2_AVAILABLE}, max_connections={HTTP_MAX_CONNECTIONS}, "
+            f"keepalive={HTTP_MAX_KEEPALIVE_CONNECTIONS}, timeout={HTTP_TIMEOUT}s"
+        )
 
+    async def aclose(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+        print(f"[HTTP] Transport closed ({len(clients)} host pools)")
 
-# EMAG Client
-class EMAGClient:
-    def __init__(self, client_id, client_secret, vendor_code, account_label=None):
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.vendor_code = vendor_code
-        
-        # Determină URL-ul API-ului bazat pe țară (conform documentației eMAG)
-        # eMAG RO: https://marketplace-api.emag.ro/api-3
-        # eMAG BG: https://marketplace-api.emag.bg/api-3
-        # eMAG HU: https://marketplace-api.emag.hu/api-3
-        label_upper = (account_label or "").upper()
-        if "HU" in label_upper or "HUNGARY" in label_upper or "UNGARIA" in label_upper or "EMAG.HU" in label_upper:
-            self.base_url = "https://marketplace-api.emag.hu/api-3"
-        elif "BG" in label_upper or "BULGARIA" in label_upper or "BULGARIA" in label_upper or "EMAG.BG" in label_upper:
-            self.base_url = "https://marketplace-api.emag.bg/api-3"
-        else:
-            # Default: România
-            self.base_url = "https://marketplace-api.emag.ro/api-3"
-        
-        self.api_url = f"{self.base_url}/order/read"
-        self.status_map = {
-            0: "canceled",
-            1: "new",
-            2: "in progress",
-            3: "prepared",
-            4: "finalized",
-            5: "returned",
-        }
 
-    def _get_auth_header(self):
-        credentials = f"{self.client_id}:{self.client_secret}"
-        encoded = base64.b64encode(credentials.encode()).decode()
-        return f"Basic {encoded}"
+http_transport = HTTPTransport()
 
-    async def fetch_orders(self, statuses=None, page=1):
-        if statuses is None:
-            statuses = [1, 2, 3]
+
+class TTLCache:
+    """Cache în memorie cu TTL și evacuare LRU; ține evidența hit/miss"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key=None, prefix=None):
+        """Fără argumente golește tot; `prefix` șterge cheile-tuplu care încep cu el"""
+        if key is not None:
+            return 1 if self._data.pop(key, None) is not None else 0
+        if prefix is not None:
+            keys = [k for k in self._data if isinstance(k, tuple) and k[0] == prefix]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+        removed = len(self._data)
+        self._data.clear()
+        return removed
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """
+    Coalescing pentru operații identice în curs: apelanții concurenți cu aceeași cheie
+    așteaptă aceeași operație și primesc același rezultat (sau aceeași excepție).
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        # shield: dacă un apelant renunță (ex. client deconectat), operația continuă pentru ceilalți
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # marcăm excepția ca preluată (o primesc apelanții)
+
+    def stats(self):
+        return {
+            "inflight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+single_flight = SingleFlight()
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket cu rată adaptivă: la throttling (429/556) rata se înjumătățește,
+    apoi crește treptat înapoi spre rata configurată la fiecare răspuns reușit.
+    """
+
+    def __init__(self, rate, burst, min_rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.throttled = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Lock-ul ține așteptătorii în ordine FIFO
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_throttle(self):
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def stats(self):
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "tokens": round(self.tokens, 3),
+            "throttled": self.throttled,
+        }
+
+
+PLATFORM_RATE_LIMITS = {
+    "emag": EMAG_RATE_LIMIT,
+    "trendyol": TRENDYOL_RATE_LIMIT,
+    "oblio": OBLIO_RATE_LIMIT,
+}
+# 429 = Too Many Requests; 556 = "Service Unavailable" folosit de Trendyol pentru throttling
+THROTTLE_STATUSES = {429, 556}
+RETRY_STATUSES = {429, 502, 503, 504, 556}
+
+rate_limiters = {}  # (platform, credential_key) -> AdaptiveRateLimiter
+
+
+def get_rate_limiter(platform, credential_key):
+    key = (platform, credential_key)
+    limiter = rate_limiters.get(key)
+    if limiter is None:
+        limiter = AdaptiveRateLimiter(
+            rate=PLATFORM_RATE_LIMITS.get(platform, 5),
+            burst=RATE_LIMIT_BURST,
+            min_rate=RATE_LIMIT_MIN_RATE,
+        )
+        rate_limiters[key] = limiter
+    return limiter
+
+
+def _retry_after_seconds(response):
+    """Valoarea header-ului Retry-After (secunde sau dată HTTP), dacă există"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt):
+    """Backoff exponențial cu full jitter"""
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * (2 ** attempt)))
+
+
+class CircuitOpenError(Exception):
+    """Cererea a fost refuzată local deoarece breaker-ul pentru (platformă, credential) este deschis"""
+
+    def __init__(self, platform, retry_in):
+        self.platform = platform
+        self.retry_in = retry_in
+        super().__init__(
+            f"{platform} API temporarily unavailable (circuit open, retry in {int(retry_in) + 1}s)"
+        )
+
+
+class CircuitBreaker:
+    """
+    closed -> open după `failure_threshold` eșecuri consecutive (erori de rețea / 5xx).
+    open -> half_open după `reset_timeout` secunde; în half_open trec doar `half_open_max_calls`
+    cereri de probă: un succes închide breaker-ul, un eșec îl redeschide.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, platform, failure_threshold, reset_timeout, half_open_max_calls):
+        self.platform = platform
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.last_error = None
+        self.total_failures = 0
+        self.total_rejected = 0
+
+    def retry_in(self):
+        if self.state != self.OPEN:
+            return 0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        """Ridică CircuitOpenError dacă cererea nu are voie să plece"""
+        if self.state == self.OPEN:
+            if self.retry_in() > 0:
+                self.total_rejected += 1
+                raise CircuitOpenError(self.platform, self.retry_in())
+            self.state = self.HALF_OPEN
+            self.half_open_calls = 0
+        if self.state == self.HALF_OPEN:
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.total_rejected += 1
+                raise CircuitOpenError(self.platform, self.reset_timeout)
+            self.half_open_calls += 1
+
+    def release_call(self):
+        """Cererea s-a încheiat fără rezultat (anulare, eroare locală): eliberează locul de probă"""
+        if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print(f"[BREAKER] {self.platform} circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.half_open_calls = 0
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.total_failures += 1
+        self.last_error = error
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"[BREAKER] {self.platform} circuit opened after {self.failures} failure(s): {error}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.half_open_calls = 0
+        self.opened_at = None
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in": round(self.retry_in(), 1),
+            "last_error": self.last_error,
+            "total_failures": self.total_failures,
+            "total_rejected": self.total_rejected,
+        }
+
+
+circuit_breakers = {}  # (platform, credential_key) -> CircuitBreaker
+
+
+def get_circuit_breaker(platform, credential_key):
+    key = (platform, credential_key)
+    breaker = circuit_breakers.get(key)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            platform,
+            failure_threshold=BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=BREAKER_RESET_TIMEOUT,
+            half_open_max_calls=BREAKER_HALF_OPEN_MAX_CALLS,
+        )
+        circuit_breakers[key] = breaker
+    return breaker
+
+
+def circuit_open_error(platform, credential_key):
+    """Mesajul de eroare dacă breaker-ul este deschis (pentru fail-fast în endpoint-uri), altfel None"""
+    breaker = circuit_breakers.get((platform, credential_key))
+    if breaker and breaker.state == CircuitBreaker.OPEN and breaker.retry_in() > 0:
+        return str(CircuitOpenError(platform, breaker.retry_in()))
+    return None
+
+
+async def upstream_request(platform, credential_key, method, url, **kwargs):
+    """
+    Toate cererile către marketplace-uri trec pe aici: circuit breaker și rate limiter
+    per (platformă, credential), apoi transportul partajat (cu retry).
+    Cât timp breaker-ul este deschis, ridică CircuitOpenError fără să mai contacteze upstream-ul.
+    """
+    breaker = get_circuit_breaker(platform, credential_key)
+    breaker.before_call()
+    try:
+        response = await _request_with_retries(platform, credential_key, method, url, **kwargs)
+    except httpx.TransportError as e:
+        breaker.record_failure(f"{type(e).__name__}: {e}")
+        raise
+    except BaseException:
+        # Anulare (pipeline Oblio, shutdown) sau altă eroare: nu spune nimic despre upstream,
+        # dar locul de probă din half_open trebuie eliberat, altfel breaker-ul rămâne blocat
+        breaker.release_call()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure(f"HTTP {response.status_code}")
+    else:
+        breaker.record_success()
+    return response
+
+
+async def _request_with_retries(platform, credential_key, method, url, **kwargs):
+    """
+    Rate limiter per (platformă, credential), apoi transportul partajat. Răspunsurile 429/5xx
+    și erorile de rețea sunt reîncercate cu backoff exponențial + jitter (sau după Retry-After)
+    de cel mult UPSTREAM_MAX_RETRIES ori.
+    """
+    limiter = get_rate_limiter(platform, credential_key)
+    attempt = 0
+    while True:
+        await limiter.acquire()
         try:
-            headers = {
-                "Authorization": self._get_auth_header(),
-                "Content-Type": "application/json",
-            }
-            payload = {
-                "data": {
-                    "itemsPerPage": 100,
-                    "currentPage": page,
-                    "status": statuses,
-                }
+            response = await http_transport.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt >= UPSTREAM_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt)
+            reason = type(e).__name__
+        else:
+            if response.status_code in THROTTLE_STATUSES:
+                limiter.on_throttle()
+            elif response.status_code < 500:
+                limiter.on_success()
+            if response.status_code not in RETRY_STATUSES or attempt >= UPSTREAM_MAX_RETRIES:
+                return response
+            retry_after = _retry_after_seconds(response)
+            delay = min(UPSTREAM_BACKOFF_MAX, retry_after) if retry_after is not None else _backoff_delay(attempt)
+            reason = response.status_code
+        attempt += 1
+        print(f"[RATE] {platform} {method} {url} -> {reason}, retry {attempt}/{UPSTREAM_MAX_RETRIES} in {delay:.2f}s (rate {limiter.rate:.2f}/s)")
+        await asyncio.sleep(delay)
+
+
+async def gather_bounded(items, worker, limit):
+    """
+    Rulează worker(item) pentru fiecare element, cu cel mult `limit` apeluri în paralel.
+    Rezultatele sunt returnate în aceeași ordine ca `items`.
+    """
+    semaphore = asyncio.Semaphore(max(1, int(limit or 1)))
+
+    async def run(item):
+        async with semaphore:
+            return await worker(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    http_transport.start()
+    db.start_maintenance(DB_CHECKPOINT_INTERVAL, DB_OPTIMIZE_INTERVAL, DB_CHECKPOINT_MODE)
+    if SYNC_SCHEDULER_ENABLED:
+        sync_scheduler.start()
+    try:
+        yield
+    finally:
+        await sync_scheduler.stop()
+        await db.stop_maintenance()
+        await http_transport.aclose()
+
+
+app = FastAPI(title="Marketplace Admin API", lifespan=lifespan)
+
+# CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
+)
+
+# Models
+class Order(BaseModel):
+    id: str
+    platform_order_id: str
+    status: str
+    order_type: int
+    vendor_code: str
+    created_at: str
+    items: List[dict] = []
+
+
+class Credential(BaseModel):
+    id: int
+    account_label: str
+    platform: str
+    client_id: str
+    vendor_code: str
+    last_sync: Optional[str] = None
+    sync_status: Optional[str] = None
+    sync_error: Optional[str] = None
+
+
+class LoginRequest(BaseModel):
+    email: str
+    password: str
+
+
+class SignupRequest(BaseModel):
+    email: str
+    password: str
+    name: str
+
+
+# EMAG Client
+class OfferCatalogTooLarge(Exception):
+    """Catalogul de oferte eMAG depășește EMAG_OFFER_INDEX_MAX_PAGES și nu poate fi indexat complet"""
+
+
+class EMAGClient:
+    PLATFORM = "emag"
+
+    def __init__(self, client_id, client_secret, vendor_code, account_label=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.vendor_code = vendor_code
+        
+        # Determină URL-ul API-ului bazat pe țară (conform documentației eMAG)
+        # eMAG RO: https://marketplace-api.emag.ro/api-3
+        # eMAG BG: https://marketplace-api.emag.bg/api-3
+        # eMAG HU: https://marketplace-api.emag.hu/api-3
+        label_upper = (account_label or "").upper()
+        if "HU" in label_upper or "HUNGARY" in label_upper or "UNGARIA" in label_upper or "EMAG.HU" in label_upper:
+            self.base_url = "https://marketplace-api.emag.hu/api-3"
+        elif "BG" in label_upper or "BULGARIA" in label_upper or "BULGARIA" in label_upper or "EMAG.BG" in label_upper:
+            self.base_url = "https://marketplace-api.emag.bg/api-3"
+        else:
+            # Default: România
+            self.base_url = "https://marketplace-api.emag.ro/api-3"
+        
+        # Identifică contul (cache-urile de oferte sunt separate per credential)
+        self.credential_key = f"{self.base_url}|{self.client_id}"
+        self.api_url = f"{self.base_url}/order/read"
+        self.status_map = {
+            0: "canceled",
+            1: "new",
+            2: "in progress",
+            3: "prepared",
+            4: "finalized",
+            5: "returned",
+        }
+
+    def _get_auth_header(self):
+        credentials = f"{self.client_id}:{self.client_secret}"
+        encoded = base64.b64encode(credentials.encode()).decode()
+        return f"Basic {encoded}"
+
+    ORDERS_PAGE_SIZE = 100
+
+    async def _fetch_orders_page(self, statuses, page):
+        """O pagină din order/read; ridică excepție la orice eroare (nu returnează listă goală)"""
+        headers = {
+            "Authorization": self._get_auth_header(),
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "data": {
+                "itemsPerPage": self.ORDERS_PAGE_SIZE,
+                "currentPage": page,
+                "status": statuses,
             }
+        }
 
-            print(f"[EMAG] Fetching orders with payload: {payload}")
+        print(f"[EMAG] Fetching orders with payload: {payload}")
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(self.api_url, json=payload, headers=headers)
-                print(f"[EMAG] Response status: {response.status_code}")
+        response = await upstream_request("emag", self.credential_key, "POST", self.api_url, json=payload, headers=headers)
+        print(f"[EMAG] Response status: {response.status_code}")
 
-                response.raise_for_status()
-                data = response.json()
+        response.raise_for_status()
+        data = response.json()
 
-                if data.get("isError"):
-                    error_msg = data.get("messages", ["Unknown error"])
-                    print(f"[ERROR] EMAG API error: {error_msg}")
-                    return []
-
-                orders = []
-                raw_orders = data.get("results", [])
-                print(f"[EMAG] Processing {len(raw_orders)} orders")
-
-                for order in raw_orders:
-                    status_val = order.get("status")
-                    status_text = self.status_map.get(status_val, str(status_val))
-
-                    items = []
-                    for item in order.get("products", []):
-                        item_data = {
-                            "sku": item.get("part_number")
-                            or item.get("ext_part_number")
-                            or "N/A",
-                            "name": item.get("name")
-                            or item.get("product_name")
-                            or "Unknown Product",
-                            "qty": item.get("quantity", 0),
-                            "price": item.get("sale_price", 0),
-                        }
-                        items.append(item_data)
-
-                    order_data = {
-                        "order_id": str(order.get("id")),
-                        "status": status_text,
-                        "order_type": order.get("type", 3),
-                        "vendor_code": self.vendor_code,
-                        "created_at": order.get("date") or order.get("created"),
-                        "items": items,
-                    }
-                    orders.append(order_data)
+        if data.get("isError"):
+            error_msg = data.get("messages", ["Unknown error"])
+            print(f"[ERROR] EMAG API error: {error_msg}")
+            raise RuntimeError(f"EMAG API error: {error_msg}")
 
-                print(f"[OK] Successfully parsed {len(orders)} orders")
-                return orders
-        except Exception as e:
-            print(f"[ERROR] Error fetching EMAG orders: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+        orders = []
+        raw_orders = data.get("results", [])
+        print(f"[EMAG] Processing {len(raw_orders)} orders")
 
-    async def fetch_product_price(self, sku):
-        """Preluează prețul unui produs de pe eMAG folosind SKU (part_number)"""
+        for order in raw_orders:
+            status_val = order.get("status")
+            status_text = self.status_map.get(status_val, str(status_val))
+
+            items = []
+            for item in order.get("products", []):
+                item_data = {
+                    "sku": item.get("part_number")
+                    or item.get("ext_part_number")
+                    or "N/A",
+                    "name": item.get("name")
+                    or item.get("product_name")
+                    or "Unknown Product",
+                    "qty": item.get("quantity", 0),
+                    "price": item.get("sale_price", 0),
+                }
+                items.append(item_data)
+
+            order_data = {
+                "order_id": str(order.get("id")),
+                "status": status_text,
+                "order_type": order.get("type", 3),
+                "vendor_code": self.vendor_code,
+                "created_at": order.get("date") or order.get("created"),
+                "items": items,
+            }
+            orders.append(order_data)
+
+        print(f"[OK] Successfully parsed {len(orders)} orders")
+        return orders
+
+    async def count_orders(self, statuses):
+        """Numărul de comenzi pentru statusurile date (order/count) sau None dacă nu se poate afla"""
         try:
             headers = {
                 "Authorization": self._get_auth_header(),
                 "Content-Type": "application/json",
             }
-            
-            # Conform documentației eMAG, folosim product_offer/read cu filtru part_number
-            offer_url = f"{self.base_url}/product_offer/read"
-            
-            # Payload conform documentației: filtru part_number
-            payload = {
-                "data": {
-                    "part_number": sku
+            payload = {"data": {"status": statuses}}
+            response = await upstream_request(
+                "emag", self.credential_key, "POST", f"{self.base_url}/order/count", json=payload, headers=headers
+            )
+            response.raise_for_status()
+            data = response.json()
+            if data.get("isError"):
+                print(f"[EMAG] order/count error: {data.get('messages')}")
+                return None
+            results = data.get("results") or {}
+            if "noOfItems" in results:
+                return int(results["noOfItems"])
+            return None
+        except Exception as e:
+            print(f"[EMAG] order/count unavailable: {type(e).__name__}: {e}")
+            return None
+
+    async def fetch_all_orders(self, statuses=None, concurrency=None):
+        """
+        Preia TOATE paginile de comenzi (nu doar prima pagină de 100).
+        Numărul de pagini vine din order/count; dacă nu e disponibil, sondăm în loturi
+        de `concurrency` pagini până la prima pagină incompletă.
+        Ridică excepție dacă o pagină eșuează, ca refresh-ul să nu șteargă comenzi lipsă.
+        """
+        if statuses is None:
+            statuses = [1, 2, 3]
+        if concurrency is None:
+            concurrency = EMAG_ORDERS_CONCURRENCY
+        page_size = self.ORDERS_PAGE_SIZE
+
+        async def fetch_page(page):
+            return await self._fetch_orders_page(statuses, page)
+
+        total = await self.count_orders(statuses)
+        if total is not None:
+            page_count = max(1, -(-total // page_size))
+            if page_count > EMAG_ORDERS_MAX_PAGES:
+                raise RuntimeError(
+                    f"eMAG reports {total} orders, more than EMAG_ORDERS_MAX_PAGES ({EMAG_ORDERS_MAX_PAGES}) pages"
+                )
+            print(f"[EMAG] {total} orders in {page_count} page(s), fetching with concurrency {concurrency}")
+            pages = await gather_bounded(range(1, page_count + 1), fetch_page, concurrency)
+        else:
+            pages = [await fetch_page(1)]
+
+        # Cât timp ultima pagină e plină mai pot exista comenzi (fără count sau sosite după count):
+        # sondăm în loturi până la prima pagină incompletă. O listă parțială ar șterge comenzi la store.
+        next_page = len(pages) + 1
+        while len(pages[-1]) >= page_size:
+            if next_page > EMAG_ORDERS_MAX_PAGES:
+                raise RuntimeError(
+                    f"eMAG orders exceed EMAG_ORDERS_MAX_PAGES ({EMAG_ORDERS_MAX_PAGES} pages of {page_size})"
+                )
+            batch = range(next_page, min(next_page + concurrency, EMAG_ORDERS_MAX_PAGES + 1))
+            batch_pages = await gather_bounded(batch, fetch_page, concurrency)
+            for page_orders in batch_pages:
+                pages.append(page_orders)
+                if len(page_orders) < page_size:
+                    break
+            next_page = batch[-1] + 1
+
+        # Comenzile se pot muta între pagini în timpul citirii - păstrăm o singură copie
+        orders = {}
+        for page_orders in pages:
+            for order in page_orders:
+                orders[order["order_id"]] = order
+        print(f"[EMAG] Fetched {len(orders)} orders from {len(pages)} page(s)")
+        return list(orders.values())
+
+    @staticmethod
+    def _offer_snapshot(offer):
+        """Păstrează din oferta eMAG doar câmpurile de preț și stoc"""
+        return {
+            "part_number": offer.get("part_number"),
+            "sale_price": offer.get("sale_price"),
+            "general_stock": offer.get("general_stock"),
+            "estimated_stock": offer.get("estimated_stock"),
+        }
+
+    @staticmethod
+    def _snapshot_price(snapshot):
+        price = snapshot.get("sale_price") if snapshot else None
+        return float(price) if price else None
+
+    @staticmethod
+    def _snapshot_stock(snapshot):
+        if not snapshot:
+            return 0
+        stock = snapshot.get("general_stock") or snapshot.get("estimated_stock") or 0
+        return int(stock) if stock else 0
+
+    async def fetch_offer_catalog(self, items_per_page=100):
+        """
+        Preia toate ofertele vendorului (product_offer/read paginat) și construiește
+        un index part_number -> {sale_price, general_stock, estimated_stock}.
+        Returnează None dacă pull-ul eșuează, iar apelantul revine la cererile per SKU.
+        Ridică OfferCatalogTooLarge dacă ultima pagină permisă este plină (index incomplet).
+        """
+        headers = {
+            "Authorization": self._get_auth_header(),
+            "Content-Type": "application/json",
+        }
+        offer_url = f"{self.base_url}/product_offer/read"
+        index = {}
+        page = 1
+        try:
+            while page <= EMAG_OFFER_INDEX_MAX_PAGES:
+                payload = {
+                    "data": {
+                        "currentPage": page,
+                        "itemsPerPage": items_per_page,
+                    }
                 }
-            }
-            
-            print(f"[EMAG] Fetching price for SKU (part_number): {sku}")
-            print(f"[EMAG] Using endpoint: {offer_url}")
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(offer_url, json=payload, headers=headers)
-                print(f"[EMAG] Response status: {response.status_code}")
-                
-                if response.status_code == 404:
-                    print(f"[EMAG] Product not found for SKU: {sku}")
-                    return None
-                
+                response = await upstream_request("emag", self.credential_key, "POST", offer_url, json=payload, headers=headers)
                 response.raise_for_status()
                 data = response.json()
-                
+
                 if data.get("isError"):
                     error_msg = data.get("messages", ["Unknown error"])
-                    print(f"[ERROR] EMAG API error: {error_msg}")
+                    print(f"[ERROR] EMAG API error while reading offer catalog: {error_msg}")
                     return None
-                
-                # Extragem prețul din răspuns conform documentației
-                # product_offer/read returnează un array de produse în "results"
+
                 results = data.get("results", [])
-                if results and len(results) > 0:
-                    offer = results[0]
-                    # Conform documentației, prețul este în câmpul "sale_price" (fără TVA)
-                    price = offer.get("sale_price")
-                    if price:
-                        print(f"[EMAG] Found price: {price} from endpoint: {offer_url}")
-                        return float(price)
-                
-                return None
+                for offer in results:
+                    part_number = offer.get("part_number")
+                    # Prima ofertă câștigă, la fel ca la citirea per SKU (results[0])
+                    if part_number and part_number not in index:
+                        index[part_number] = self._offer_snapshot(offer)
+
+                if len(results) < items_per_page:
+                    break
+                page += 1
+            else:
+                # Ultima pagină permisă a fost plină: indexul ar fi incomplet, iar SKU-urile lipsă
+                # ar apărea ca stoc 0 / preț negăsit - apelantul revine la cererile per SKU
+                print(f"[EMAG] Offer catalog exceeds EMAG_OFFER_INDEX_MAX_PAGES ({EMAG_OFFER_INDEX_MAX_PAGES}), not indexing")
+                raise OfferCatalogTooLarge(f"more than {EMAG_OFFER_INDEX_MAX_PAGES} pages")
+
+            print(f"[EMAG] Offer catalog indexed: {len(index)} SKUs from {page} page(s)")
+            return index
+        except OfferCatalogTooLarge:
+            raise
         except Exception as e:
-            print(f"[ERROR] Error fetching EMAG product price: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
+            print(f"[ERROR] Error fetching EMAG offer catalog: {type(e).__name__}: {e}")
             return None
 
+    async def fetch_product_price(self, sku, use_index=None):
+        """Preluează prețul unui produs de pe eMAG folosind SKU (part_number)"""
+        if use_index is None:
+            use_index = EMAG_OFFER_INDEX_ENABLED
+        if use_index:
+            index = await emag_offer_index.get(self)
+            if index is not None:
+                price = self._snapshot_price(index.get(sku))
+                print(f"[EMAG] Price for SKU {sku} from offer index: {price}")
+                return price
+
+        snapshot = await self.fetch_offer_snapshot(sku)
+        price = self._snapshot_price(snapshot)
+        if price is not None:
+            print(f"[EMAG] Found price: {price} for SKU: {sku}")
+        return price
+
     async def fetch_product_stock(self, sku):
         """Preluează stocul unui produs de pe eMAG folosind SKU (part_number)"""
+        snapshot = await self.fetch_offer_snapshot(sku)
+        if snapshot is None:
+            return None
+        # Conform documentației eMAG, stocul este în general_stock sau estimated_stock
+        # general_stock = suma stocului din toate depozitele
+        # estimated_stock = stocul estimat (ține cont de stocul rezervat pe comenzi neconfirmate)
+        stock = self._snapshot_stock(snapshot)
+        print(f"[EMAG] Found stock: {stock} (general_stock={snapshot.get('general_stock')}, estimated_stock={snapshot.get('estimated_stock')}) for SKU: {sku}")
+        return stock
+
+    async def fetch_offer_snapshot(self, sku):
+        """
+        Returnează snapshot-ul ofertei (preț + stoc) pentru un SKU, din cache dacă e proaspăt.
+        Prețul și stocul citesc același snapshot, deci un singur product_offer/read le servește pe amândouă.
+        None = eroare (nu se pune în cache); snapshot gol = produsul nu există.
+        """
+        cache_key = (self.credential_key, sku)
+        snapshot = emag_offer_cache.get(cache_key)
+        if snapshot is not None:
+            return snapshot
+        snapshot = await self._read_offer(sku)
+        if snapshot is not None:
+            emag_offer_cache.set(cache_key, snapshot)
+        return snapshot
+
+    async def _read_offer(self, sku):
+        """product_offer/read filtrat după part_number"""
         try:
             headers = {
                 "Authorization": self._get_auth_header(),
                 "Content-Type": "application/json",
             }
             
-            # Folosim product_offer/read pentru a obține stocul
+            # Conform documentației eMAG, folosim product_offer/read cu filtru part_number
             offer_url = f"{self.base_url}/product_offer/read"
             
+            # Payload conform documentației: filtru part_number
             payload = {
                 "data": {
                     "part_number": sku
                 }
             }
             
-            print(f"[EMAG] Fetching stock for SKU (part_number): {sku}")
+            print(f"[EMAG] Fetching offer for SKU (part_number): {sku}")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(offer_url, json=payload, headers=headers)
-                
-                if response.status_code == 404:
-                    print(f"[EMAG] Product not found for SKU: {sku}")
-                    return None
-                
-                response.raise_for_status()
-                data = response.json()
-                
-                if data.get("isError"):
-                    error_msg = data.get("messages", ["Unknown error"])
-                    print(f"[ERROR] EMAG API error: {error_msg}")
-                    return None
-                
-                results = data.get("results", [])
-                if results and len(results) > 0:
-                    offer = results[0]
-                    # Conform documentației eMAG, stocul este în general_stock sau estimated_stock
-                    # general_stock = suma stocului din toate depozitele
-                    # estimated_stock = stocul estimat (ține cont de stocul rezervat pe comenzi neconfirmate)
-                    stock = offer.get("general_stock") or offer.get("estimated_stock") or 0
-                    print(f"[EMAG] Found stock: {stock} (general_stock={offer.get('general_stock')}, estimated_stock={offer.get('estimated_stock')}) for SKU: {sku}")
-                    return int(stock) if stock else 0
-                
-                print(f"[EMAG] No results found for SKU: {sku}")
-                return 0
+            response = await upstream_request("emag", self.credential_key, "POST", offer_url, json=payload, headers=headers)
+            print(f"[EMAG] Response status: {response.status_code}")
+            
+            if response.status_code == 404:
+                print(f"[EMAG] Product not found for SKU: {sku}")
+                return self._offer_snapshot({"part_number": sku})
+            
+            response.raise_for_status()
+            data = response.json()
+            
+            if data.get("isError"):
+                error_msg = data.get("messages", ["Unknown error"])
+                print(f"[ERROR] EMAG API error: {error_msg}")
+                return None
+            
+            # product_offer/read returnează un array de produse în "results"
+            # Prețul este în "sale_price" (fără TVA), stocul în general_stock / estimated_stock
+            results = data.get("results", [])
+            if results and len(results) > 0:
+                return self._offer_snapshot(results[0])
+            
+            print(f"[EMAG] No results found for SKU: {sku}")
+            return self._offer_snapshot({"part_number": sku})
+        except CircuitOpenError:
+            # Breaker deschis: apelantul trebuie să afle, nu să primească "preț / stoc negăsit"
+            raise
         except Exception as e:
-            print(f"[ERROR] Error fetching EMAG product stock: {type(e).__name__}: {e}")
+            print(f"[ERROR] Error fetching EMAG product offer: {type(e).__name__}: {e}")
             import traceback
             traceback.print_exc()
             return None
 
-    async def fetch_products_stock(self, product_codes=None):
+    async def fetch_products_stock(self, product_codes=None, concurrency=None, use_index=None):
         """
         Fetch-uiește stocurile pentru mai multe produse de pe eMAG
         product_codes: listă de SKU-uri (part_number)
+        concurrency: câte SKU-uri se interoghează în paralel (implicit EMAG_STOCK_CONCURRENCY)
+        use_index: răspunde din indexul de oferte (implicit EMAG_OFFER_INDEX_ENABLED)
         Returnează un dict: {sku: stock_value}
         """
         if not product_codes:
             return {}
+        if use_index is None:
+            use_index = EMAG_OFFER_INDEX_ENABLED
+        if use_index:
+            index = await emag_offer_index.get(self)
+            if index is not None:
+                print(f"[EMAG] Answering stock for {len(product_codes)} SKUs from offer index")
+                return {
+                    sku: {
+                        "code": sku,
+                        "stock": self._snapshot_stock(index.get(sku))
+                    }
+                    for sku in product_codes
+                }
+        if concurrency is None:
+            concurrency = EMAG_STOCK_CONCURRENCY
         
-        stock_dict = {}
-        for sku in product_codes:
+        async def fetch_one(sku):
             try:
                 stock = await self.fetch_product_stock(sku)
                 if stock is not None:
-                    stock_dict[sku] = {
+                    return {
                         "code": sku,
                         "stock": stock
                     }
-                else:
-                    stock_dict[sku] = {
-                        "code": sku,
-                        "stock": 0
-                    }
+            except CircuitOpenError:
+                # Nu raportăm stoc 0 cât timp eMAG e indisponibil; endpoint-ul întoarce eroarea
+                raise
             except Exception as e:
                 print(f"[ERROR] Error fetching stock for {sku}: {e}")
-                stock_dict[sku] = {
-                    "code": sku,
-                    "stock": 0
-                }
+            return {
+                "code": sku,
+                "stock": 0
+            }
         
-        return stock_dict
+        # Fan-out limitat; rezultatele sunt asamblate în ordinea SKU-urilor primite
+        results = await gather_bounded(product_codes, fetch_one, concurrency)
+        return {sku: entry for sku, entry in zip(product_codes, results)}
+
+
+class EMAGOfferIndex:
+    """
+    Indexul de oferte eMAG per credential, reconstruit după TTL.
+    Un singur pull rulează per credential; cererile concurente îl așteaptă pe acela.
+    """
+
+    def __init__(self, ttl, retry_after):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._entries = {}  # credential_key -> (built_at, index)
+        self._unavailable = {}  # credential_key -> momentul până la care nu mai încercăm pull-ul
+        self._locks = {}
+
+    def _fresh(self, credential_key):
+        entry = self._entries.get(credential_key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def _skip(self, credential_key):
+        # După un pull fără index nu îl repetăm la fiecare cerere: un catalog prea mare se reîncearcă
+        # abia după TTL, o eroare tranzitorie după retry_after; între timp se folosesc cererile per SKU
+        retry_at = self._unavailable.get(credential_key)
+        return retry_at is not None and time.monotonic() < retry_at
+
+    async def get(self, client):
+        index = self._fresh(client.credential_key)
+        if index is not None or self._skip(client.credential_key):
+            return index
+        lock = self._locks.setdefault(client.credential_key, asyncio.Lock())
+        async with lock:
+            index = self._fresh(client.credential_key)
+            if index is not None or self._skip(client.credential_key):
+                return index
+            try:
+                index = await client.fetch_offer_catalog()
+            except OfferCatalogTooLarge:
+                self._unavailable[client.credential_key] = time.monotonic() + self.ttl
+                return None
+            if index is None:
+                self._unavailable[client.credential_key] = time.monotonic() + self.retry_after
+            else:
+                self._unavailable.pop(client.credential_key, None)
+                self._entries[client.credential_key] = (time.monotonic(), index)
+                # Pull-ul complet încălzește și cache-ul de snapshot-uri per SKU
+                for part_number, snapshot in index.items():
+                    emag_offer_cache.set((client.credential_key, part_number), snapshot)
+            return index
+
+    def invalidate(self, credential_key=None):
+        if credential_key is None:
+            self._entries.clear()
+            self._unavailable.clear()
+        else:
+            self._entries.pop(credential_key, None)
+            self._unavailable.pop(credential_key, None)
+
+    def stats(self):
+        return {
+            "credentials": len(self._entries),
+            "unavailable": sum(1 for retry_at in self._unavailable.values() if time.monotonic() < retry_at),
+            "skus": sum(len(index) for _, index in self._entries.values()),
+            "ttl": self.ttl,
+            "retry_after": self.retry_after,
+        }
+
+
+emag_offer_index = EMAGOfferIndex(EMAG_OFFER_INDEX_TTL, EMAG_OFFER_INDEX_RETRY)
+emag_offer_cache = TTLCache(maxsize=EMAG_OFFER_CACHE_SIZE, ttl=EMAG_OFFER_CACHE_TTL)
 
 
 # Trendyol Client
 class TrendyolClient:
+    PLATFORM = "trendyol"
+
     def __init__(self, supplier_id, api_key, api_secret, account_label=None):
         self.supplier_id = supplier_id
         self.api_key = api_key
         self.api_secret = api_secret
         self.account_label = account_label or ""
         self.base_url = "https://apigw.trendyol.com"
+        self.credential_key = f"{self.supplier_id}|{self.api_key}"
         self.status_map = {
             "Awaiting": "awaiting",
             "Created": "new",
@@ -436,122 +1924,176 @@ class TrendyolClient:
 
     async def fetch_orders(self, status="Created", page=0, size=200, start_ms=None, end_ms=None):
         try:
-            url = f"{self.base_url}/integration/order/sellers/{self.supplier_id}/orders"
-            params = {
-                "status": status,
-                "page": page,
-                "size": size,
-                "orderByField": "PackageLastModifiedDate",
-                "orderByDirection": "DESC",
-            }
-            if start_ms is not None:
-                params["startDate"] = int(start_ms)
-            if end_ms is not None:
-                params["endDate"] = int(end_ms)
+            return await self._fetch_orders_page(status, page, size, start_ms, end_ms)
+        except Exception as e:
+            print(f"[ERROR] Error fetching Trendyol orders: {type(e).__name__}: {e}")
+            import traceback
+            traceback.print_exc()
+            return [], 0, 0
 
-            headers = {
-                "Authorization": self._get_auth_header(),
-                "Content-Type": "application/json",
-                "User-Agent": f"{self.supplier_id} - SelfIntegration",
+    async def _fetch_orders_page(self, status, page, size=200, start_ms=None, end_ms=None):
+        """O pagină de comenzi; ridică excepție la orice eroare (inclusiv 401)"""
+        url = f"{self.base_url}/integration/order/sellers/{self.supplier_id}/orders"
+        params = {
+            "page": page,
+            "size": size,
+            "orderByField": "PackageLastModifiedDate",
+            "orderByDirection": "DESC",
+        }
+        # Fără status = toate pachetele (folosit de sync-ul incremental)
+        if status is not None:
+            params["status"] = status
+        if start_ms is not None:
+            params["startDate"] = int(start_ms)
+        if end_ms is not None:
+            params["endDate"] = int(end_ms)
+
+        headers = {
+            "Authorization": self._get_auth_header(),
+            "Content-Type": "application/json",
+            "User-Agent": f"{self.supplier_id} - SelfIntegration",
+        }
+
+        print(f"[TRENDYOL] Fetching orders from {url} with params: {params}")
+
+        response = await upstream_request("trendyol", self.credential_key, "GET", url, headers=headers, params=params)
+        print(f"[TRENDYOL] Response status: {response.status_code}")
+
+        if response.status_code == 401:
+            print(f"[ERROR] TRENDYOL Authentication failed (401)")
+
+        response.raise_for_status()
+        data = response.json()
+
+        orders = []
+        raw_orders = data.get("content", [])
+        total_elements = data.get("totalElements", 0)
+        total_pages = data.get("totalPages", 0)
+        print(f"[TRENDYOL] Processing {len(raw_orders)} orders (page {page + 1}/{total_pages}, total: {total_elements})")
+
+        for order in raw_orders:
+            status_text = self.status_map.get(
+                order.get("status"), order.get("status", "unknown")
+            )
+
+            items = []
+            for line in order.get("lines", []):
+                item_data = {
+                    "sku": line.get("merchantSku")
+                    or line.get("sku")
+                    or "N/A",
+                    "name": line.get("productName") or "Unknown Product",
+                    "qty": line.get("quantity", 0),
+                    "price": float(line.get("price", 0))
+                    if line.get("price")
+                    else 0,
+                }
+                items.append(item_data)
+
+            # Extragem țara din răspunsul API-ului Trendyol
+            # API-ul returnează informații despre țară în shipmentAddress
+            vendor_code = "trendyol_ro"  # Default: România
+            
+            # Verificăm shipmentAddress pentru a extrage țara
+            shipment_address = order.get("shipmentAddress", {})
+            if isinstance(shipment_address, dict):
+                # Verificăm diferite câmpuri posibile pentru țară
+                country_code = (shipment_address.get("countryCode", "") or shipment_address.get("country", "") or "").upper()
+                city = (shipment_address.get("city", "") or "").upper()
+                
+                # Log pentru debugging - doar pentru prima comandă
+                if len(raw_orders) > 0 and raw_orders.index(order) == 0:
+                    print(f"[TRENDYOL DEBUG] Sample shipmentAddress: {shipment_address}")
+                    print(f"[TRENDYOL DEBUG] countryCode={country_code}, city={city}")
+                
+                # Determină țara bazat pe countryCode sau city
+                # Grecia: countryCode = "GR" sau city conține "ATHENS", "THESSALONIKI", etc.
+                if country_code == "GR" or "ATHENS" in city or "THESSALONIKI" in city or "GREECE" in city:
+                    vendor_code = "trendyol_gr"
+                # Bulgaria: countryCode = "BG" sau city conține "SOFIA", "VARNA", etc.
+                elif country_code == "BG" or "SOFIA" in city or "VARNA" in city or "BULGARIA" in city:
+                    vendor_code = "trendyol_bg"
+                # România: countryCode = "RO" sau "TR" (Turcia pentru Trendyol TR)
+                elif country_code == "RO" or country_code == "TR" or "BUCHAREST" in city or "ROMANIA" in city:
+                    vendor_code = "trendyol_ro"
+            else:
+                # Dacă nu găsim shipmentAddress, verificăm și alte câmpuri
+                invoice_address = order.get("invoiceAddress", {})
+                if isinstance(invoice_address, dict):
+                    country_code = (invoice_address.get("countryCode", "") or invoice_address.get("country", "") or "").upper()
+                    if country_code == "GR":
+                        vendor_code = "trendyol_gr"
+                    elif country_code == "BG":
+                        vendor_code = "trendyol_bg"
+                    elif country_code in ["RO", "TR"]:
+                        vendor_code = "trendyol_ro"
+                
+                # Log pentru debugging - doar pentru prima comandă
+                if len(raw_orders) > 0 and raw_orders.index(order) == 0:
+                    print(f"[TRENDYOL DEBUG] No shipmentAddress, checking invoiceAddress: {invoice_address}")
+            
+            order_data = {
+                "order_id": str(order.get("orderNumber")),
+                "status": status_text,
+                "order_type": 3,
+                "vendor_code": vendor_code,
+                "created_at": self._convert_timestamp(order.get("orderDate")),
+                "items": items,
             }
+            orders.append(order_data)
 
-            print(f"[TRENDYOL] Fetching orders from {url} with params: {params}")
+        print(f"[OK] Successfully parsed {len(orders)} Trendyol orders")
+        return orders, total_pages, total_elements
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, headers=headers, params=params)
-                print(f"[TRENDYOL] Response status: {response.status_code}")
+    async def fetch_all_orders(self, statuses, size=200, concurrency=None, start_ms=None, end_ms=None):
+        """
+        Preia toate paginile pentru toate statusurile date, în paralel.
+        Pagina 0 a fiecărui status raportează total_pages; restul paginilor (și celelalte statusuri)
+        sunt independente, deci rulează concurent sub un singur plafon de concurență.
+        Comenzile sunt de-duplicate după orderNumber. Ridică excepție dacă o pagină eșuează.
+        """
+        if concurrency is None:
+            concurrency = TRENDYOL_ORDERS_CONCURRENCY
+        semaphore = asyncio.Semaphore(max(1, concurrency))
 
-                if response.status_code == 401:
-                    print(f"[ERROR] TRENDYOL Authentication failed (401)")
-                    return [], 0, 0
+        async def fetch_page(status, page):
+            async with semaphore:
+                return await self._fetch_orders_page(status, page, size, start_ms, end_ms)
 
-                response.raise_for_status()
-                data = response.json()
+        def check_cap(status, pages):
+            # O listă trunchiată ar face store-ul să șteargă comenzile rămase în afara ei
+            if pages > TRENDYOL_ORDERS_MAX_PAGES:
+                raise RuntimeError(
+                    f"Trendyol status {status} exceeds TRENDYOL_ORDERS_MAX_PAGES ({TRENDYOL_ORDERS_MAX_PAGES} pages of {size})"
+                )
 
-                orders = []
-                raw_orders = data.get("content", [])
-                total_elements = data.get("totalElements", 0)
-                total_pages = data.get("totalPages", 0)
-                print(f"[TRENDYOL] Processing {len(raw_orders)} orders (page {page + 1}/{total_pages}, total: {total_elements})")
-
-                for order in raw_orders:
-                    status_text = self.status_map.get(
-                        order.get("status"), order.get("status", "unknown")
-                    )
-
-                    items = []
-                    for line in order.get("lines", []):
-                        item_data = {
-                            "sku": line.get("merchantSku")
-                            or line.get("sku")
-                            or "N/A",
-                            "name": line.get("productName") or "Unknown Product",
-                            "qty": line.get("quantity", 0),
-                            "price": float(line.get("price", 0))
-                            if line.get("price")
-                            else 0,
-                        }
-                        items.append(item_data)
-
-                    # Extragem țara din răspunsul API-ului Trendyol
-                    # API-ul returnează informații despre țară în shipmentAddress
-                    vendor_code = "trendyol_ro"  # Default: România
-                    
-                    # Verificăm shipmentAddress pentru a extrage țara
-                    shipment_address = order.get("shipmentAddress", {})
-                    if isinstance(shipment_address, dict):
-                        # Verificăm diferite câmpuri posibile pentru țară
-                        country_code = (shipment_address.get("countryCode", "") or shipment_address.get("country", "") or "").upper()
-                        city = (shipment_address.get("city", "") or "").upper()
-                        
-                        # Log pentru debugging - doar pentru prima comandă
-                        if len(raw_orders) > 0 and raw_orders.index(order) == 0:
-                            print(f"[TRENDYOL DEBUG] Sample shipmentAddress: {shipment_address}")
-                            print(f"[TRENDYOL DEBUG] countryCode={country_code}, city={city}")
-                        
-                        # Determină țara bazat pe countryCode sau city
-                        # Grecia: countryCode = "GR" sau city conține "ATHENS", "THESSALONIKI", etc.
-                        if country_code == "GR" or "ATHENS" in city or "THESSALONIKI" in city or "GREECE" in city:
-                            vendor_code = "trendyol_gr"
-                        # Bulgaria: countryCode = "BG" sau city conține "SOFIA", "VARNA", etc.
-                        elif country_code == "BG" or "SOFIA" in city or "VARNA" in city or "BULGARIA" in city:
-                            vendor_code = "trendyol_bg"
-                        # România: countryCode = "RO" sau "TR" (Turcia pentru Trendyol TR)
-                        elif country_code == "RO" or country_code == "TR" or "BUCHAREST" in city or "ROMANIA" in city:
-                            vendor_code = "trendyol_ro"
-                    else:
-                        # Dacă nu găsim shipmentAddress, verificăm și alte câmpuri
-                        invoice_address = order.get("invoiceAddress", {})
-                        if isinstance(invoice_address, dict):
-                            country_code = (invoice_address.get("countryCode", "") or invoice_address.get("country", "") or "").upper()
-                            if country_code == "GR":
-                                vendor_code = "trendyol_gr"
-                            elif country_code == "BG":
-                                vendor_code = "trendyol_bg"
-                            elif country_code in ["RO", "TR"]:
-                                vendor_code = "trendyol_ro"
-                        
-                        # Log pentru debugging - doar pentru prima comandă
-                        if len(raw_orders) > 0 and raw_orders.index(order) == 0:
-                            print(f"[TRENDYOL DEBUG] No shipmentAddress, checking invoiceAddress: {invoice_address}")
-                    
-                    order_data = {
-                        "order_id": str(order.get("orderNumber")),
-                        "status": status_text,
-                        "order_type": 3,
-                        "vendor_code": vendor_code,
-                        "created_at": self._convert_timestamp(order.get("orderDate")),
-                        "items": items,
-                    }
-                    orders.append(order_data)
+        async def fetch_status(status):
+            orders, total_pages, total_elements = await fetch_page(status, 0)
+            print(f"[TRENDYOL] Status {status}: {total_elements} orders in {total_pages} page(s)")
+            check_cap(status, total_pages)
+            last_page = orders
+            if total_pages > 1:
+                rest = await asyncio.gather(*(fetch_page(status, page) for page in range(1, total_pages)))
+                for page_orders, _, _ in rest:
+                    orders.extend(page_orders)
+                last_page = rest[-1][0]
+            # Ultima pagină plină: pot fi sosit comenzi după ce s-a calculat total_pages
+            page = max(1, total_pages)
+            while len(last_page) >= size:
+                check_cap(status, page + 1)
+                last_page, _, _ = await fetch_page(status, page)
+                orders.extend(last_page)
+                page += 1
+            return orders
 
-                print(f"[OK] Successfully parsed {len(orders)} Trendyol orders")
-                return orders, total_pages, total_elements
-        except Exception as e:
-            print(f"[ERROR] Error fetching Trendyol orders: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            return [], 0, 0
+        per_status = await asyncio.gather(*(fetch_status(status) for status in statuses))
+
+        orders = {}
+        for status_orders in per_status:
+            for order in status_orders:
+                orders[order["order_id"]] = order
+        print(f"[TRENDYOL] Fetched {len(orders)} unique orders for statuses {statuses}")
+        return list(orders.values())
 
     def _convert_timestamp(self, timestamp_ms):
         if not timestamp_ms:
@@ -591,76 +2133,81 @@ class TrendyolClient:
             
             print(f"[TRENDYOL] Fetching stock for SKU: {sku}")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(url, headers=headers, params=params)
+            response = await upstream_request("trendyol", self.credential_key, "GET", url, headers=headers, params=params)
+            
+            if response.status_code == 200:
+                data = response.json()
+                content = data.get("content", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    content = data.get("content", [])
-                    
-                    if content and len(content) > 0:
-                        product = content[0]
-                        # Câmpul principal pentru stoc în Trendyol este "quantity"
-                        stock = (product.get("quantity") or 
-                                product.get("stockQuantity") or 
-                                product.get("stock") or
-                                0)
-                        print(f"[TRENDYOL] Found stock: {stock} for SKU: {sku}")
-                        return int(stock) if stock else 0
-                    else:
-                        print(f"[TRENDYOL] No products found for SKU: {sku}")
-                        return 0
-                elif response.status_code in [556, 503, 429]:
-                    # Rate limiting sau service unavailable
-                    print(f"[TRENDYOL] API rate limited ({response.status_code}) for SKU: {sku}")
-                    return None  # None indică că nu avem acces temporar
-                elif response.status_code == 403:
-                    # Forbidden - IP-ul nu este whitelisted sau lipsesc permisiuni
-                    print(f"[TRENDYOL] API access forbidden (403) - verifică IP whitelist sau permisiuni")
-                    return None
+                if content and len(content) > 0:
+                    product = content[0]
+                    # Câmpul principal pentru stoc în Trendyol este "quantity"
+                    stock = (product.get("quantity") or 
+                            product.get("stockQuantity") or 
+                            product.get("stock") or
+                            0)
+                    print(f"[TRENDYOL] Found stock: {stock} for SKU: {sku}")
+                    return int(stock) if stock else 0
                 else:
-                    print(f"[TRENDYOL] Unexpected error {response.status_code} for SKU: {sku}")
+                    print(f"[TRENDYOL] No products found for SKU: {sku}")
                     return 0
-                    
+            elif response.status_code in [556, 503, 429]:
+                # Rate limiting sau service unavailable
+                print(f"[TRENDYOL] API rate limited ({response.status_code}) for SKU: {sku}")
+                return None  # None indică că nu avem acces temporar
+            elif response.status_code == 403:
+                # Forbidden - IP-ul nu este whitelisted sau lipsesc permisiuni
+                print(f"[TRENDYOL] API access forbidden (403) - verifică IP whitelist sau permisiuni")
+                return None
+            else:
+                print(f"[TRENDYOL] Unexpected error {response.status_code} for SKU: {sku}")
+                return 0
+                
+        except CircuitOpenError as e:
+            print(f"[TRENDYOL] {e} - SKU: {sku}")
+            return None  # la fel ca 429/503: API-ul nu este accesibil temporar
         except Exception as e:
             print(f"[ERROR] Error fetching Trendyol product stock: {type(e).__name__}: {e}")
             return 0
 
-    async def fetch_products_stock(self, product_codes=None):
+    async def fetch_products_stock(self, product_codes=None, concurrency=None):
         """
         Fetch-uiește stocurile pentru mai multe produse de pe Trendyol
         product_codes: listă de SKU-uri (merchantSku)
+        concurrency: câte SKU-uri se interoghează în paralel (implicit TRENDYOL_STOCK_CONCURRENCY)
         Returnează un dict: {sku: stock_value} sau {"error": "message"} dacă API-ul nu este accesibil
         """
         if not product_codes:
             return {}
+        if concurrency is None:
+            concurrency = TRENDYOL_STOCK_CONCURRENCY
         
-        stock_dict = {}
-        api_unavailable = False
-        
-        for sku in product_codes:
+        async def fetch_one(sku):
             try:
                 stock = await self.fetch_product_stock(sku)
                 if stock is None:
                     # API nu este accesibil (rate limit, 403, etc.)
-                    api_unavailable = True
-                    stock_dict[sku] = {
+                    return {
                         "code": sku,
                         "stock": -1,  # -1 indică că API-ul nu este accesibil
                         "error": "API unavailable"
                     }
-                else:
-                    stock_dict[sku] = {
-                        "code": sku,
-                        "stock": stock
-                    }
+                return {
+                    "code": sku,
+                    "stock": stock
+                }
             except Exception as e:
                 print(f"[ERROR] Error fetching stock for {sku}: {e}")
-                stock_dict[sku] = {
+                return {
                     "code": sku,
                     "stock": 0
                 }
         
+        # Fan-out limitat; rezultatele sunt asamblate în ordinea SKU-urilor primite
+        results = await gather_bounded(product_codes, fetch_one, concurrency)
+        stock_dict = {sku: entry for sku, entry in zip(product_codes, results)}
+        api_unavailable = any(entry["stock"] == -1 for entry in results)
+        
         if api_unavailable:
             stock_dict["_api_status"] = "unavailable"
         
@@ -669,6 +2216,8 @@ class TrendyolClient:
 
 # Oblio Client (pentru stocuri)
 class OblioClient:
+    PLATFORM = "oblio"
+
     def __init__(self, cif, email, client_secret):
         self.cif = cif
         self.email = email
@@ -676,137 +2225,320 @@ class OblioClient:
         self.base_url = "https://www.oblio.eu/api"
         self.access_token = None
         self.token_expires_at = None
+        # Cheia sub care token-ul este partajat între instanțe (nu conține secretul în clar)
+        self.token_key = hashlib.sha256(f"{email}:{client_secret}".encode()).hexdigest()
+        self.credential_key = self.token_key
 
     async def _ensure_token(self):
-        """Obține sau reîmprospătează token-ul de acces"""
+        """Obține token-ul de acces din cache-ul de proces sau cere unul nou"""
         if self.access_token and self.token_expires_at:
             if datetime.now().timestamp() < self.token_expires_at:
                 return  # Token-ul este încă valid
         
-        # Obține un token nou
+        self.access_token, self.token_expires_at = await oblio_token_cache.get_token(self)
+
+    async def _request_token(self):
+        """Cere un token nou de la /authorize/token; returnează (access_token, expires_at)"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/authorize/token",
-                    data={
-                        "client_id": self.email,
-                        "client_secret": self.client_secret
-                    },
-                    headers={"Content-Type": "application/x-www-form-urlencoded"}
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                self.access_token = data.get("access_token")
-                expires_in = int(data.get("expires_in", 3600))
-                self.token_expires_at = datetime.now().timestamp() + expires_in - 60  # 60s buffer
-                
-                print(f"[OBLIO] Token obtained successfully, expires in {expires_in}s")
+            response = await upstream_request(
+                "oblio",
+                self.token_key,
+                "POST",
+                f"{self.base_url}/authorize/token",
+                data={
+                    "client_id": self.email,
+                    "client_secret": self.client_secret
+                },
+                headers={"Content-Type": "application/x-www-form-urlencoded"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            access_token = data.get("access_token")
+            expires_in = int(data.get("expires_in", 3600))
+            token_expires_at = datetime.now().timestamp() + expires_in - 60  # 60s buffer
+            
+            print(f"[OBLIO] Token obtained successfully, expires in {expires_in}s")
+            return access_token, token_expires_at
+        except CircuitOpenError:
+            raise
         except Exception as e:
             print(f"[ERROR] Failed to obtain Oblio token: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to authenticate with Oblio: {str(e)}")
 
-    async def fetch_products_stock(self, product_codes=None):
+    async def fetch_stock_snapshot(self):
         """
-        Fetch-uiește stocurile pentru produse din Oblio
-        product_codes: listă de coduri de produse pentru care să aducă stocurile
+        Descarcă toată nomenclatura și returnează stocul agregat pe cod: {code: {code, name, stock, unit}}
+        Ridică excepție dacă o pagină eșuează (un snapshot parțial nu trebuie pus în cache).
         """
         await self._ensure_token()
         
-        try:
-            url = f"{self.base_url}/nomenclature/products"
-            headers = {
-                "Authorization": f"Bearer {self.access_token}",
-                "Content-Type": "application/json"
-            }
-            params = {"cif": self.cif}
+        url = f"{self.base_url}/nomenclature/products"
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json"
+        }
+        page_size = 250  # Oblio returnează 250 produse per pagină
+        window = max(1, OBLIO_PAGE_CONCURRENCY)
+        
+        print(f"[OBLIO] Fetching products stock from {url} ({window} pages in flight)")
+        
+        async def fetch_page(offset):
+            params = {"cif": self.cif, "offset": offset}
+            response = await upstream_request("oblio", self.token_key, "GET", url, headers=headers, params=params)
             
-            print(f"[OBLIO] Fetching products stock from {url}")
+            if response.status_code == 401:
+                # Token revocat/expirat înainte de termen - următoarea cerere cere unul nou
+                await oblio_token_cache.invalidate(self.token_key)
             
-            all_products = []
-            offset = 0
+            if response.status_code != 200:
+                print(f"[ERROR] Oblio API error: {response.text}")
+                raise RuntimeError(f"Oblio API error {response.status_code} at offset {offset}")
             
-            # Fetch paginat (250 produse per pagină)
+            return response.json().get("data", [])
+        
+        # Pipeline: ținem `window` offset-uri în zbor și agregăm paginile în ordinea offset-ului,
+        # pe măsură ce sosesc - în memorie stau cel mult `window` pagini brute, nu tot catalogul
+        stock_dict = {}
+        pending = {}  # offset -> asyncio.Task
+        next_offset = 0
+        total_products = 0
+        try:
             while True:
-                params["offset"] = offset
+                while len(pending) < window:
+                    pending[next_offset] = asyncio.create_task(fetch_page(next_offset))
+                    next_offset += page_size
                 
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.get(url, headers=headers, params=params)
-                    print(f"[OBLIO] Response status: {response.status_code}")
-                    
-                    if response.status_code != 200:
-                        print(f"[ERROR] Oblio API error: {response.text}")
-                        break
-                    
-                    data = response.json()
-                    products = data.get("data", [])
-                    
-                    if not products:
-                        break  # Nu mai sunt produse
-                    
-                    all_products.extend(products)
-                    print(f"[OBLIO] Fetched {len(products)} products at offset {offset}")
-                    
-                    # Dacă am primit mai puțin de 250, înseamnă că am ajuns la final
-                    if len(products) < 250:
-                        break
-                    
-                    offset += 250
-            
-            print(f"[OBLIO] Total products fetched: {len(all_products)}")
-            
-            # Creăm un dict pentru lookup rapid după cod produs
-            # IMPORTANT: Sumăm stocul din TOATE produsele cu același cod (nu suprascriem!)
-            stock_dict = {}
-            for product in all_products:
-                code = product.get("code", "")
-                if code:
-                    # Calculăm stocul total din toate gestiunile (pentru mărfuri)
-                    stock_data = product.get("stock", [])
-                    product_stock = 0
-                    
-                    if isinstance(stock_data, list) and len(stock_data) > 0:
-                        # Sumăm stocul din toate gestiunile - verificăm și "stockQuantity" în fiecare gestiune
-                        for s in stock_data:
-                            qty = s.get("quantity") or s.get("stockQuantity") or 0
-                            product_stock += float(qty)
-                    elif isinstance(stock_data, (int, float)):
-                        # Dacă stock este direct un număr
-                        product_stock = float(stock_data)
-                    else:
-                        # Încercăm câmpuri alternative direct pe produs
-                        product_stock = float(product.get("stockQuantity") or product.get("quantity") or 0)
-                    
-                    # Log pentru debugging
-                    if product_codes and code in product_codes:
-                        print(f"[OBLIO DEBUG] Product '{code}': current product stock={product_stock}, total so far={stock_dict.get(code, {}).get('stock', 0)}")
-                    
-                    # Sumăm stocul din toate produsele cu același cod
-                    if code in stock_dict:
-                        # Există deja un produs cu acest cod - adăugăm stocul
-                        stock_dict[code]["stock"] += product_stock
-                        print(f"[OBLIO DEBUG] Added {product_stock} to existing stock for '{code}', new total={stock_dict[code]['stock']}")
-                    else:
-                        # Primul produs cu acest cod
-                        stock_dict[code] = {
-                            "code": code,
-                            "name": product.get("name", ""),
-                            "stock": product_stock,
-                            "unit": product.get("measuringUnit", "buc")
-                        }
-            
-            # Dacă s-au specificat coduri specifice, returnăm doar pe alea
-            if product_codes:
-                filtered_stock = {code: stock_dict.get(code) for code in product_codes if code in stock_dict}
-                return filtered_stock
-            
-            return stock_dict
-            
-        except Exception as e:
-            print(f"[ERROR] Error fetching Oblio products: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            return {}
+                offset = min(pending)
+                products = await pending.pop(offset)
+                self._fold_products(stock_dict, products)
+                total_products += len(products)
+                print(f"[OBLIO] Fetched {len(products)} products at offset {offset}")
+                
+                # Prima pagină incompletă marchează finalul catalogului
+                if len(products) < page_size:
+                    break
+        finally:
+            # Offset-urile de după final (sau după o eroare) nu mai sunt necesare
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+        
+        print(f"[OBLIO] Total products fetched: {total_products} ({len(stock_dict)} codes)")
+        return stock_dict
+
+    @staticmethod
+    def _fold_products(stock_dict, products):
+        """
+        Adaugă o pagină de produse în agregatul de stoc per cod.
+        IMPORTANT: Sumăm stocul din TOATE produsele cu același cod (nu suprascriem!)
+        """
+        for product in products:
+            code = product.get("code", "")
+            if code:
+                # Calculăm stocul total din toate gestiunile (pentru mărfuri)
+                stock_data = product.get("stock", [])
+                product_stock = 0
+                
+                if isinstance(stock_data, list) and len(stock_data) > 0:
+                    # Sumăm stocul din toate gestiunile - verificăm și "stockQuantity" în fiecare gestiune
+                    for s in stock_data:
+                        qty = s.get("quantity") or s.get("stockQuantity") or 0
+                        product_stock += float(qty)
+                elif isinstance(stock_data, (int, float)):
+                    # Dacă stock este direct un număr
+                    product_stock = float(stock_data)
+                else:
+                    # Încercăm câmpuri alternative direct pe produs
+                    product_stock = float(product.get("stockQuantity") or product.get("quantity") or 0)
+                
+                # Sumăm stocul din toate produsele cu același cod
+                if code in stock_dict:
+                    # Există deja un produs cu acest cod - adăugăm stocul
+                    stock_dict[code]["stock"] += product_stock
+                    print(f"[OBLIO DEBUG] Added {product_stock} to existing stock for '{code}', new total={stock_dict[code]['stock']}")
+                else:
+                    # Primul produs cu acest cod
+                    stock_dict[code] = {
+                        "code": code,
+                        "name": product.get("name", ""),
+                        "stock": product_stock,
+                        "unit": product.get("measuringUnit", "buc")
+                    }
+
+
+def filter_stock_snapshot(stock_dict, product_codes):
+    """Doar codurile cerute care există în snapshot"""
+    return {code: stock_dict.get(code) for code in product_codes if code in stock_dict}
+
+
+class OblioStockCache:
+    """
+    Snapshot-ul de stoc Oblio per credential, construit dintr-un singur pull complet.
+    Proaspăt (< ttl): servit direct. Învechit (< ttl + stale_ttl): servit imediat și
+    reîmprospătat în fundal. Altfel cererea așteaptă pull-ul (single-flight per credential).
+    """
+
+    def __init__(self, ttl, stale_ttl):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}  # cache_key -> (fetched_at, stock_dict)
+        self._refreshing = {}  # cache_key -> asyncio.Task
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    @staticmethod
+    def cache_key(client):
+        return f"{client.cif}|{client.token_key}"
+
+    async def get_snapshot(self, client):
+        key = self.cache_key(client)
+        entry = self._entries.get(key)
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.fresh_hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh(client)  # revalidare în fundal
+                return entry[1]
+        self.misses += 1
+        return await asyncio.shield(self._refresh(client))
+
+    async def get_products_stock(self, client, product_codes):
+        stock_dict = await self.get_snapshot(client)
+        return filter_stock_snapshot(stock_dict, product_codes)
+
+    def _refresh(self, client):
+        """Pornește (sau reutilizează) task-ul de reîmprospătare pentru credential"""
+        key = self.cache_key(client)
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, client))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda t: self._refresh_done(key, t))
+        return task
+
+    async def _load(self, key, client):
+        stock_dict = await client.fetch_stock_snapshot()
+        self._entries[key] = (time.monotonic(), stock_dict)
+        print(f"[OBLIO] Stock snapshot refreshed: {len(stock_dict)} codes")
+        return stock_dict
+
+    def _refresh_done(self, key, task):
+        self._refreshing.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            print(f"[ERROR] Oblio stock snapshot refresh failed: {task.exception()}")
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return {
+            "credentials": len(self._entries),
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "fresh_hits": self.fresh_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refresh_errors": self.refresh_errors,
+            "refreshing": len(self._refreshing),
+        }
+
+
+oblio_stock_cache = OblioStockCache(ttl=OBLIO_STOCK_TTL, stale_ttl=OBLIO_STOCK_STALE_TTL)
+
+
+class OblioTokenCache:
+    """
+    Token-uri de acces Oblio partajate la nivel de proces, per credential.
+    Reînnoirea este single-flight: cererile concurente așteaptă același /authorize/token.
+    Opțional (OBLIO_TOKEN_PERSIST=1) token-urile sunt salvate în SQLite și supraviețuiesc unui restart.
+    """
+
+    def __init__(self, persist=False):
+        self.persist = persist
+        self._tokens = {}  # token_key -> (access_token, expires_at)
+        self._locks = {}
+
+    async def _valid(self, token_key):
+        entry = self._tokens.get(token_key)
+        if entry is None and self.persist:
+            row = (await db.query(
+                "SELECT access_token, expires_at FROM oblio_tokens WHERE token_key = ?",
+                (token_key,)
+            )).fetchone()
+            if row:
+                entry = (row["access_token"], row["expires_at"])
+                self._tokens[token_key] = entry
+        if entry and entry[0] and datetime.now().timestamp() < entry[1]:
+            return entry
+        return None
+
+    async def get_token(self, client):
+        entry = await self._valid(client.token_key)
+        if entry:
+            return entry
+        lock = self._locks.setdefault(client.token_key, asyncio.Lock())
+        async with lock:
+            entry = await self._valid(client.token_key)
+            if entry:
+                return entry
+            entry = await client._request_token()
+            self._tokens[client.token_key] = entry
+            if self.persist:
+                await db.execute(
+                    """
+                    INSERT INTO oblio_tokens (token_key, access_token, expires_at)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(token_key) DO UPDATE SET
+                        access_token = excluded.access_token,
+                        expires_at = excluded.expires_at
+                    """,
+                    (client.token_key, entry[0], entry[1])
+                )
+            return entry
+
+    async def invalidate(self, token_key):
+        self._tokens.pop(token_key, None)
+        if self.persist:
+            await db.execute("DELETE FROM oblio_tokens WHERE token_key = ?", (token_key,))
+
+
+oblio_token_cache = OblioTokenCache(persist=OBLIO_TOKEN_PERSIST)
+
+
+def client_for_credential(cred_d):
+    """Construiește clientul API potrivit platformei unui rând din credentials"""
+    platform = cred_d.get("platform")
+    if platform == 1:
+        return EMAGClient(
+            client_id=cred_d.get("client_id", ""),
+            client_secret=cred_d.get("client_secret", ""),
+            vendor_code=cred_d.get("vendor_code", ""),
+            account_label=cred_d.get("account_label", ""),
+        )
+    if platform == 2:
+        return TrendyolClient(
+            supplier_id=cred_d.get("vendor_code") or cred_d.get("client_id"),
+            api_key=cred_d.get("client_id"),
+            api_secret=cred_d.get("client_secret", ""),
+            account_label=cred_d.get("account_label", ""),
+        )
+    if platform == 3:
+        return OblioClient(
+            cif=cred_d.get("vendor_code", ""),
+            email=cred_d.get("client_id", ""),
+            client_secret=cred_d.get("client_secret", ""),
+        )
+    raise ValueError(f"Unknown platform: {platform}")
 
 
 @app.get("/")
@@ -816,17 +2548,22 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "db": DB_PATH}
+    return {
+        "status": "ok",
+        "db": DB_PATH,
+        "storage": await db.active_profile(),
+        "maintenance": db.maintenance_stats(),
+    }
 
 
-def get_current_user(request: Request):
+async def get_current_user(request: Request):
     """Extract user from token"""
     auth_header = request.headers.get("Authorization", "")
     if auth_header.startswith("Bearer "):
         token = auth_header.replace("Bearer ", "")
         try:
             user_id = int(token.split("-")[-1])
-            cur = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            cur = await db.query("SELECT * FROM users WHERE id = ?", (user_id,))
             user = cur.fetchone()
             if user:
                 return row_to_dict(user)
@@ -834,6 +2571,11 @@ def get_current_user(request: Request):
             pass
     raise HTTPException(status_code=401, detail="Unauthorized")
 
+def normalize_product_codes(product_codes):
+    """Coduri unice și sortate - cheia de coalescing nu depinde de ordinea din request"""
+    return sorted({str(code) for code in product_codes if code})
+
+
 def _clean_str(val: Optional[str]) -> str:
     if val is None:
         return ""
@@ -842,7 +2584,7 @@ def _clean_str(val: Optional[str]) -> str:
 
 @app.post("/auth/login")
 async def login(request: LoginRequest):
-    cur = conn.execute("SELECT * FROM users WHERE email = ?", (request.email,))
+    cur = await db.query("SELECT * FROM users WHERE email = ?", (request.email,))
     user = cur.fetchone()
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -871,7 +2613,7 @@ async def signup(request: SignupRequest):
             status_code=400, detail="Email, password, and name are required"
         )
 
-    cur = conn.execute("SELECT 1 FROM users WHERE email = ?", (request.email,))
+    cur = await db.query("SELECT 1 FROM users WHERE email = ?", (request.email,))
     if cur.fetchone():
         raise HTTPException(status_code=409, detail="Email already registered")
 
@@ -882,14 +2624,13 @@ async def signup(request: SignupRequest):
 
     now = datetime.now().isoformat()
     password_hash = hash_password(request.password)
-    cur = conn.execute(
+    cur = await db.execute(
         """
         INSERT INTO users (email, password_hash, name, created_at)
         VALUES (?, ?, ?, ?)
         """,
         (request.email, password_hash, request.name, now),
     )
-    conn.commit()
     new_id = cur.lastrowid
 
     return {
@@ -912,7 +2653,7 @@ async def get_platforms():
 
 @app.post("/credentials")
 async def create_credential(request: Request, data: dict):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     account_label = _clean_str(data.get("account_label"))
     platform_id = int(data.get("platform_id") or 0)
     client_id = _clean_str(data.get("client_id"))
@@ -932,7 +2673,7 @@ async def create_credential(request: Request, data: dict):
     if not client_secret:
         raise HTTPException(status_code=400, detail="client_secret is required")
 
-    cur = conn.execute(
+    cur = await db.execute(
         """
         INSERT INTO credentials (user_id, account_label, platform, client_id, client_secret, vendor_code, last_sync)
         VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -947,10 +2688,9 @@ async def create_credential(request: Request, data: dict):
             None,
         ),
     )
-    conn.commit()
     cred_id = cur.lastrowid
 
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE id = ? AND user_id = ?", (cred_id, user["id"])
     )
     return row_to_dict(cur.fetchone())
@@ -958,8 +2698,8 @@ async def create_credential(request: Request, data: dict):
 
 @app.get("/credentials")
 async def list_credentials(request: Request):
-    user = get_current_user(request)
-    cur = conn.execute(
+    user = await get_current_user(request)
+    cur = await db.query(
         "SELECT * FROM credentials WHERE user_id = ? ORDER BY id ASC", (user["id"],)
     )
     return [row_to_dict(r) for r in cur.fetchall()]
@@ -967,8 +2707,8 @@ async def list_credentials(request: Request):
 
 @app.put("/credentials/{cred_id}")
 async def update_credential(cred_id: int, request: Request, data: dict):
-    user = get_current_user(request)
-    cur = conn.execute(
+    user = await get_current_user(request)
+    cur = await db.query(
         "SELECT * FROM credentials WHERE id = ? AND user_id = ?",
         (cred_id, user["id"]),
     )
@@ -997,13 +2737,12 @@ async def update_credential(cred_id: int, request: Request, data: dict):
             values.append(val)
     if fields:
         values.extend([cred_id, user["id"]])
-        conn.execute(
+        await db.execute(
             f"UPDATE credentials SET {', '.join(fields)} WHERE id = ? AND user_id = ?",
             tuple(values),
         )
-        conn.commit()
 
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE id = ? AND user_id = ?", (cred_id, user["id"])
     )
     return row_to_dict(cur.fetchone())
@@ -1011,83 +2750,210 @@ async def update_credential(cred_id: int, request: Request, data: dict):
 
 @app.delete("/credentials/{cred_id}")
 async def delete_credential(cred_id: int, request: Request):
-    user = get_current_user(request)
-    cur = conn.execute(
+    user = await get_current_user(request)
+    cur = await db.execute(
         "DELETE FROM credentials WHERE id = ? AND user_id = ?", (cred_id, user["id"])
     )
-    conn.commit()
     if cur.rowcount == 0:
         raise HTTPException(status_code=404, detail="Credential not found")
     return {"message": "Deleted"}
 
 
+# Câmpurile pe care le poate returna /orders (is_active este doar pentru filtrare). items este
+# reconstruit din order_items ca array JSON, cu aceleași chei și aceeași ordine ca înainte de normalizare.
+ORDER_FIELDS = {
+    "id": "o.id",
+    "user_id": "o.user_id",
+    "credential_id": "o.credential_id",
+    "platform_order_id": "o.platform_order_id",
+    "status": "o.status",
+    "order_type": "o.order_type",
+    "vendor_code": "o.vendor_code",
+    "created_at": "o.created_at",
+    "items": """(
+        SELECT json_group_array(json_object('sku', i.sku, 'name', i.name, 'qty', i.qty, 'price', i.price))
+        FROM (SELECT * FROM order_items WHERE order_id = o.id ORDER BY line_no) i
+    )""",
+}
+ORDERS_MAX_LIMIT = 1000
+
+
+def encode_orders_cursor(created_at, order_id):
+    """Cursor opac pentru pagina următoare: poziția (created_at, id) a ultimei comenzi returnate"""
+    raw = json.dumps([created_at, order_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_orders_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        if not isinstance(order_id, str) or not (created_at is None or isinstance(created_at, str)):
+            raise ValueError("bad cursor values")
+        return created_at, order_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/orders")
-async def list_orders(request: Request, credential_id: Optional[int] = None):
-    user = get_current_user(request)
-    
-    # Statusuri permise:
-    # EMAG: "new" (1) și "in progress" (2)
-    # Trendyol: "new" (Created), "processing" (Picking), "invoiced" (Invoiced)
-    allowed_statuses = ['new', 'in progress', 'processing', 'invoiced']
-    
-    if credential_id:
-        cur = conn.execute(
-            """
-            SELECT * FROM orders
-            WHERE user_id = ? AND credential_id = ?
-            ORDER BY created_at DESC
-            """,
-            (user["id"], credential_id),
-        )
+async def list_orders(
+    request: Request,
+    response: Response,
+    credential_id: Optional[int] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Comenzile active ale userului (vezi ACTIVE_ORDER_STATUSES), cele mai noi primele
+    (created_at DESC, id DESC; comenzile fără dată la final).
+    Opțional filtrate după credential_id și status (ex. ?status=new).
+
+    Paginare keyset: ?limit=N returnează cel mult N comenzi, iar header-ul X-Next-Cursor
+    (dacă mai sunt) se trimite înapoi ca ?cursor=... pentru pagina următoare. X-Total-Count
+    conține numărul total de comenzi pentru filtrele date. Fără limit se returnează toate.
+    ?fields=id,status,created_at limitează câmpurile returnate (ex. fără items).
+    """
+    user = await get_current_user(request)
+
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in ORDER_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
     else:
-        cur = conn.execute(
-            """
-            SELECT * FROM orders
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            """,
-            (user["id"],),
-        )
-    rows = cur.fetchall()
-    print(f"[ORDERS] Found {len(rows)} total orders for user {user['id']}, credential_id={credential_id}")
-    
+        selected = list(ORDER_FIELDS)
+    if limit is not None and not 1 <= limit <= ORDERS_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {ORDERS_MAX_LIMIT}")
+
+    # Filtrarea pe statusurile active se face în SQL, pe orders.is_active (indexat)
+    where = ["o.user_id = ?", "o.is_active = 1"]
+    params = [user["id"]]
+    if credential_id:
+        where.insert(1, "o.credential_id = ?")
+        params.append(credential_id)
+    if status:
+        where.append("lower(o.status) = ?")
+        params.append(status.strip().lower())
+
+    count_cur = await db.query(
+        f"SELECT COUNT(*) FROM orders o WHERE {' AND '.join(where)}", tuple(params)
+    )
+    response.headers["X-Total-Count"] = str(count_cur.fetchone()[0])
+
+    # Segmentele paginii, în ordinea sortării. NULL-urile sunt cele mai mici în SQLite, deci la DESC
+    # comenzile fără dată vin după toate cele datate; fiecare segment e un seek separat pe index,
+    # ca pagina după un cursor să coste cât prima pagină, nu cât un OFFSET.
+    segments = [("", [])]
+    if cursor:
+        after_created, after_id = decode_orders_cursor(cursor)
+        if after_created is None:
+            segments = [(" AND o.created_at IS NULL AND o.id < ?", [after_id])]
+        else:
+            # (created_at, id) < (?, ?) e fals pentru created_at NULL, de aceea coada NULL e segment separat
+            segments = [
+                (" AND (o.created_at, o.id) < (?, ?)", [after_created, after_id]),
+                (" AND o.created_at IS NULL", []),
+            ]
+
+    # id și created_at sunt necesare pentru cursor chiar dacă nu sunt cerute
+    columns = list(dict.fromkeys(selected + ["id", "created_at"]))
+    rows = []
+    for condition, condition_params in segments:
+        sql = f"""
+            SELECT {', '.join(f'{ORDER_FIELDS[c]} AS {c}' for c in columns)} FROM orders o
+            WHERE {' AND '.join(where)}{condition}
+            ORDER BY o.created_at DESC, o.id DESC
+        """
+        segment_params = params + condition_params
+        if limit is not None:
+            sql += " LIMIT ?"
+            segment_params.append(limit + 1 - len(rows))  # un rând în plus ne spune dacă există pagina următoare
+
+        cur = await db.query(sql, tuple(segment_params))
+        rows.extend(cur.fetchall())
+        if limit is not None and len(rows) > limit:
+            break
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_orders_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
     results = []
-    filtered_count = 0
     for r in rows:
         d = row_to_dict(r)
-        try:
-            d["items"] = json.loads(d.get("items") or "[]")
-        except Exception:
-            d["items"] = []
-        
-        # Filtrăm - afișăm doar comenzile active (new, in progress, picking)
-        if d.get("status", "").lower() not in allowed_statuses:
-            filtered_count += 1
-            print(f"[ORDERS]   - FILTERED Order {d['platform_order_id']}, Status: {d['status']} (not active)")
-            continue
-            
-        print(f"[ORDERS]   + ACTIVE Order {d['platform_order_id']}, Status: {d['status']}, Credential: {d['credential_id']}")
-        results.append(d)
-    
-    print(f"[ORDERS] Returning {len(results)} active orders (filtered out {filtered_count} orders)")
-    
+        if "items" in d:
+            try:
+                d["items"] = json.loads(d.get("items") or "[]")
+            except Exception:
+                d["items"] = []
+        results.append({c: d[c] for c in selected})
+
+    print(f"[ORDERS] Returning {len(results)} active orders for user {user['id']} (credential_id={credential_id}, status={status})")
     return results
 
 
+@app.get("/orders/demand")
+async def get_orders_demand(request: Request, credential_id: Optional[int] = None):
+    """
+    Cantitatea în așteptare per SKU din comenzile active, pe toate credențialele și vendor_code-urile
+    (eMAG RO/HU/BG, trendyol_ro/gr/bg). Citită din sku_demand, actualizată la fiecare sync,
+    deci costul nu depinde de numărul de comenzi.
+    """
+    user = await get_current_user(request)
+    where = ["d.user_id = ?"]
+    params = [user["id"]]
+    if credential_id:
+        where.append("d.credential_id = ?")
+        params.append(credential_id)
+
+    cur = await db.query(
+        f"""
+        SELECT d.sku, d.credential_id, d.vendor_code, c.platform, d.qty
+        FROM sku_demand d
+        LEFT JOIN credentials c ON c.id = d.credential_id
+        WHERE {' AND '.join(where)}
+        ORDER BY d.sku
+        """,
+        tuple(params),
+    )
+
+    def as_number(value):
+        return int(value) if float(value).is_integer() else value
+
+    skus = {}
+    for r in cur.fetchall():
+        entry = skus.setdefault(r["sku"], {"sku": r["sku"], "total": 0, "emag": 0, "trendyol": 0, "sources": []})
+        qty = as_number(r["qty"])
+        entry["total"] += qty
+        if r["platform"] == 1:
+            entry["emag"] += qty
+        elif r["platform"] == 2:
+            entry["trendyol"] += qty
+        entry["sources"].append({
+            "credential_id": r["credential_id"],
+            "vendor_code": r["vendor_code"],
+            "platform": r["platform"],
+            "qty": qty,
+        })
+
+    return {"skus": sorted(skus.values(), key=lambda e: (-e["total"], e["sku"]))}
+
+
 @app.post("/oblio/stock")
 async def get_oblio_stock(request: Request, data: dict):
     """
     Returnează stocurile Oblio pentru produsele specificate
     Request body: {"product_codes": ["SKU1", "SKU2", ...]}
     """
-    user = get_current_user(request)
+    user = await get_current_user(request)
     product_codes = data.get("product_codes", [])
     
     if not product_codes:
         return {"stock": {}}
     
     # Găsim credențialele Oblio pentru user
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE user_id = ? AND platform = 3",
         (user["id"],)
     )
@@ -1106,11 +2972,19 @@ async def get_oblio_stock(request: Request, data: dict):
             client_secret=cred_d.get("client_secret", "")  # Token-ul secret
         )
         
+        # Fără pre-check pe breaker: snapshot-ul din cache (proaspăt sau învechit) răspunde și în timpul
+        # unei căderi; CircuitOpenError apare doar dacă e nevoie de un pull nou
         print(f"[OBLIO] Fetching stock for {len(product_codes)} products")
-        stock_dict = await client.fetch_products_stock(product_codes)
+        codes = normalize_product_codes(product_codes)
+        stock_dict = await single_flight.do(
+            (user["id"], cred_d["id"], "oblio_stock", tuple(codes)),
+            lambda: oblio_stock_cache.get_products_stock(client, codes),
+        )
         
         return {"stock": stock_dict}
     
+    except CircuitOpenError as e:
+        return {"stock": {}, "error": str(e)}
     except Exception as e:
         print(f"[ERROR] Error fetching Oblio stock: {e}")
         import traceback
@@ -1124,14 +2998,14 @@ async def get_emag_stock(request: Request, data: dict):
     Returnează stocurile eMAG pentru produsele specificate (doar România)
     Request body: {"product_codes": ["SKU1", "SKU2", ...]}
     """
-    user = get_current_user(request)
+    user = await get_current_user(request)
     product_codes = data.get("product_codes", [])
     
     if not product_codes:
         return {"stock": {}}
     
     # Găsim credențialele eMAG RO pentru user
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE user_id = ? AND platform = 1",
         (user["id"],)
     )
@@ -1160,11 +3034,19 @@ async def get_emag_stock(request: Request, data: dict):
             account_label=emag_ro_cred.get("account_label", ""),
         )
         
+        # Indexul de oferte proaspăt răspunde și cu breaker-ul deschis; doar cererile reale spre eMAG
+        # ridică CircuitOpenError
         print(f"[EMAG] Fetching stock for {len(product_codes)} products")
-        stock_dict = await client.fetch_products_stock(product_codes)
+        codes = normalize_product_codes(product_codes)
+        stock_dict = await single_flight.do(
+            (user["id"], emag_ro_cred["id"], "emag_stock", tuple(codes)),
+            lambda: client.fetch_products_stock(codes),
+        )
         
         return {"stock": stock_dict}
     
+    except CircuitOpenError as e:
+        return {"stock": {}, "error": str(e)}
     except Exception as e:
         print(f"[ERROR] Error fetching EMAG stock: {e}")
         import traceback
@@ -1178,14 +3060,14 @@ async def get_trendyol_stock(request: Request, data: dict):
     Returnează stocurile Trendyol pentru produsele specificate (shared cross-platform)
     Request body: {"product_codes": ["SKU1", "SKU2", ...]}
     """
-    user = get_current_user(request)
+    user = await get_current_user(request)
     product_codes = data.get("product_codes", [])
     
     if not product_codes:
         return {"stock": {}}
     
     # Găsim credențialele Trendyol pentru user (orice credential Trendyol, deoarece stocul este shared)
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE user_id = ? AND platform = 2 LIMIT 1",
         (user["id"],)
     )
@@ -1205,8 +3087,16 @@ async def get_trendyol_stock(request: Request, data: dict):
             account_label=cred_d.get("account_label", ""),
         )
         
+        open_error = circuit_open_error(client.PLATFORM, client.credential_key)
+        if open_error:
+            return {"stock": {}, "error": open_error}
+        
         print(f"[TRENDYOL] Fetching stock for {len(product_codes)} products")
-        stock_dict = await client.fetch_products_stock(product_codes)
+        codes = normalize_product_codes(product_codes)
+        stock_dict = await single_flight.do(
+            (user["id"], cred_d["id"], "trendyol_stock", tuple(codes)),
+            lambda: client.fetch_products_stock(codes),
+        )
         
         return {"stock": stock_dict}
     
@@ -1220,9 +3110,9 @@ async def get_trendyol_stock(request: Request, data: dict):
 @app.get("/test/trendyol/{credential_id}")
 async def test_trendyol(credential_id: int, request: Request):
     """Endpoint de test pentru a verifica ce returnează API-ul Trendyol"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE id = ? AND user_id = ?",
         (credential_id, user["id"]),
     )
@@ -1249,191 +3139,604 @@ async def test_trendyol(credential_id: int, request: Request):
         orders, total_pages, total_elements = await client.fetch_orders(
             status=status, page=0, size=200
         )
-        print(f"[TEST] Status {status}: {len(orders)} orders, {total_pages} pages, {total_elements} total")
-        test_results.append({
-            "status": status,
-            "orders_count": len(orders),
-            "total_pages": total_pages,
-            "total_elements": total_elements,
-            "sample_orders": [o["order_id"] for o in orders[:5]]
-        })
-    
-    return {"test_results": test_results}
+        print(f"[TEST] Status {status}: {len(orders)} orders, {total_pages} pages, {total_elements} total")
+        test_results.append({
+            "status": status,
+            "orders_count": len(orders),
+            "total_pages": total_pages,
+            "total_elements": total_elements,
+            "sample_orders": [o["order_id"] for o in orders[:5]]
+        })
+    
+    return {"test_results": test_results}
+
+def trendyol_sync_plan(cred_d, force_full=False):
+    """
+    Decide dacă refresh-ul Trendyol poate fi incremental (doar pachetele modificate după watermark)
+    sau trebuie o reconciliere completă. Returnează (mode, start_ms, end_ms).
+    """
+    now = time.time()
+    end_ms = int(now * 1000)
+    watermark = cred_d.get("sync_watermark")
+    last_full_sync = cred_d.get("last_full_sync")
+
+    if force_full or not TRENDYOL_INCREMENTAL_SYNC or not watermark or not last_full_sync:
+        return "full", None, end_ms
+    try:
+        full_age = now - datetime.fromisoformat(last_full_sync).timestamp()
+    except ValueError:
+        return "full", None, end_ms
+    if full_age >= TRENDYOL_FULL_SYNC_INTERVAL:
+        return "full", None, end_ms
+
+    start_ms = int(watermark - TRENDYOL_WATERMARK_OVERLAP * 1000)
+    if end_ms - start_ms >= TRENDYOL_MAX_INCREMENTAL_WINDOW * 1000:
+        return "full", None, end_ms
+    return "incremental", start_ms, end_ms
+
+
+@app.post("/orders/refresh")
+async def refresh_orders(request: Request):
+    print(f"[REFRESH] Refresh request started")
+    user = await get_current_user(request)
+
+    try:
+        request_body = await request.json()
+    except Exception:
+        request_body = {}
+
+    print(f"[REFRESH] Request data: {request_body}")
+    cred_id = request_body.get("credential_id")
+    print(f"[REFRESH] Looking for credential ID: {cred_id}")
+
+    cur = await db.query(
+        "SELECT * FROM credentials WHERE id = ? AND user_id = ?",
+        (cred_id, user["id"]),
+    )
+    cred = cur.fetchone()
+
+    if not cred:
+        print(f"[REFRESH] Credential not found")
+        raise HTTPException(status_code=404, detail="Credential not found")
+
+    cred_d = row_to_dict(cred)
+    full_sync = bool(request_body.get("full_sync"))
+    # Refresh-uri identice concurente (două tab-uri, dublu click) așteaptă aceeași rulare
+    return await single_flight.do(
+        (user["id"], cred_d["id"], "refresh", full_sync),
+        lambda: sync_credential_orders(user["id"], cred_d, full_sync=full_sync),
+    )
+
+
+async def fetch_credential_orders(cred_d, full_sync=False):
+    """
+    Faza de fetch a unui sync: preia comenzile de la marketplace fără să atingă baza de date.
+    Returnează un dict cu modul de sync, comenzile active și (la incremental) cele închise.
+    """
+    platform = cred_d.get("platform", 1)
+    print(f"[REFRESH] Using platform: {platform}")
+
+    # "full" = lista primită este completă, iar comenzile lipsă se șterg
+    sync_mode = "full"
+    sync_end_ms = None
+    removed_orders = []
+
+    if platform == 1:
+        print(f"[REFRESH] Fetching EMAG orders")
+        client = EMAGClient(
+            client_id=cred_d["client_id"],
+            client_secret=cred_d.get("client_secret", ""),
+            vendor_code=cred_d["vendor_code"],
+            account_label=cred_d.get("account_label", ""),
+        )
+        # DOAR comenzi noi (1) și in progress (2)
+        print(f"[REFRESH][EMAG] Fetching ONLY 'new' (1) and 'in progress' (2) orders")
+        new_orders = await client.fetch_all_orders(statuses=[1, 2])
+    elif platform == 2:
+        print(f"[REFRESH] Fetching Trendyol orders")
+        try:
+            client = TrendyolClient(
+                supplier_id=cred_d.get("vendor_code") or cred_d.get("client_id"),
+                api_key=cred_d.get("client_id"),
+                api_secret=cred_d.get("client_secret", ""),
+                account_label=cred_d.get("account_label", ""),
+            )
+            print(f"[REFRESH] TrendyolClient created successfully")
+
+            # Preluăm comenzile noi, în procesare și cele cu factură în așteptare
+            status_list = [
+                "Created",          # Comenzi noi
+                "Picking",          # În procesare/pregătire
+                "Invoiced",         # Cu factură (invoice pending)
+            ]
+            sync_mode, start_ms, sync_end_ms = trendyol_sync_plan(
+                cred_d, force_full=full_sync
+            )
+            if sync_mode == "incremental":
+                # Doar pachetele modificate după watermark, indiferent de status.
+                # Cele care au ieșit din statusurile active sunt șterse explicit.
+                print(f"[REFRESH][TRENDYOL] Incremental sync of packages modified since {start_ms}")
+                changed_orders = await client.fetch_all_orders(
+                    [None], size=200, start_ms=start_ms, end_ms=sync_end_ms
+                )
+                new_orders = [o for o in changed_orders if is_active_status(o.get("status"))]
+                removed_orders = [o for o in changed_orders if not is_active_status(o.get("status"))]
+                print(f"[REFRESH][TRENDYOL] {len(new_orders)} active and {len(removed_orders)} closed packages changed")
+            else:
+                print(f"[REFRESH][TRENDYOL] Fetching 'Created', 'Picking' and 'Invoiced' orders")
+                print(f"[REFRESH][TRENDYOL] Fetching ALL orders without date filters")
+                # Paginile și statusurile se preiau în paralel; o eroare oprește refresh-ul
+                # înainte de ștergere, ca să nu pierdem comenzi din cauza unei pagini eșuate
+                new_orders = await client.fetch_all_orders(status_list, size=200)
+        except Exception as trendyol_error:
+            print(f"[REFRESH] Trendyol error: {trendyol_error}")
+            import traceback
+            traceback.print_exc()
+            raise
+    else:
+        print(f"[REFRESH] Unknown platform: {platform}")
+        raise HTTPException(status_code=400, detail=f"Unknown platform: {platform}")
+
+    return {
+        "platform": platform,
+        "sync_mode": sync_mode,
+        "sync_end_ms": sync_end_ms,
+        "new_orders": new_orders,
+        "removed_orders": removed_orders,
+    }
+
+
+def store_credential_orders(conn, user_id, cred_d, result):
+    """
+    Faza de scriere a unui sync: upsert comenzi, ștergeri și last_sync/watermark.
+    Rulează pe conexiunea de scriere (db.write); nu face commit - apelantul decide granița
+    tranzacției (un credential sau refresh-all).
+    """
+    cred_id = cred_d["id"]
+    platform = result["platform"]
+    sync_mode = result["sync_mode"]
+    sync_end_ms = result["sync_end_ms"]
+    new_orders = result["new_orders"]
+    removed_orders = result["removed_orders"]
+
+    print(f"[REFRESH] Got {len(new_orders)} orders, updating database")
+
+    # Pas 1: ID-urile primite merg într-un tabel temporar (per conexiune), folosit pentru
+    # numărarea update-urilor și pentru ștergerea prin anti-join
+    rows = [
+        (
+            f"{order['order_id']}-{cred_id}",
+            user_id,
+            cred_id,
+            order["order_id"],
+            order.get("status"),
+            order.get("order_type"),
+            order.get("vendor_code"),
+            order.get("created_at"),
+            int(is_active_status(order.get("status"))),
+        )
+        for order in new_orders
+    ]
+    item_rows = [
+        (
+            f"{order['order_id']}-{cred_id}",
+            line_no,
+            user_id,
+            cred_id,
+            item.get("sku"),
+            item.get("name"),
+            item.get("qty"),
+            item.get("price"),
+        )
+        for order in new_orders
+        for line_no, item in enumerate(order.get("items") or [])
+    ]
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS sync_order_ids (id TEXT PRIMARY KEY)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS sync_removed_ids (id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM sync_order_ids")
+    conn.execute("DELETE FROM sync_removed_ids")
+    conn.executemany("INSERT OR IGNORE INTO sync_order_ids (id) VALUES (?)", [(row[0],) for row in rows])
+    updated = conn.execute(
+        "SELECT COUNT(*) FROM orders WHERE id IN (SELECT id FROM sync_order_ids)"
+    ).fetchone()[0]
+    received = conn.execute("SELECT COUNT(*) FROM sync_order_ids").fetchone()[0]
+
+    # Pas 2: Comenzile vechi care nu mai sunt în lista nouă se șterg
+    # (înseamnă că au fost procesate și nu mai sunt "new" sau "in progress")
+    if sync_mode == "incremental":
+        # Sync incremental: lista conține doar modificările, deci ștergem doar
+        # comenzile care au trecut explicit într-un status inactiv
+        conn.executemany(
+            "INSERT OR IGNORE INTO sync_removed_ids SELECT id FROM orders WHERE id = ? AND user_id = ? AND credential_id = ?",
+            [(f"{o['order_id']}-{cred_id}", user_id, cred_id) for o in removed_orders],
+        )
+    elif rows:
+        # Anti-join: comenzile credentialului care nu sunt în lista primită
+        conn.execute(
+            """
+            INSERT INTO sync_removed_ids
+            SELECT id FROM orders
+            WHERE user_id = ? AND credential_id = ?
+              AND id NOT IN (SELECT id FROM sync_order_ids)
+            """,
+            (user_id, cred_id),
+        )
+    else:
+        # Dacă nu sunt comenzi noi, ștergem TOATE comenzile vechi pentru acest credential
+        print(f"[REFRESH] No new orders found, deleting all old orders for this credential")
+        conn.execute(
+            "INSERT INTO sync_removed_ids SELECT id FROM orders WHERE user_id = ? AND credential_id = ?",
+            (user_id, cred_id),
+        )
+
+    # Cererea agregată pe SKU: scădem contribuția actuală a comenzilor rescrise sau șterse...
+    apply_sku_demand(
+        conn, -1, "o.id IN (SELECT id FROM sync_order_ids UNION ALL SELECT id FROM sync_removed_ids)"
+    )
+
+    # Pas 3: upsert în bloc
+    conn.executemany(
+        """
+        INSERT INTO orders (id, user_id, credential_id, platform_order_id, status, order_type, vendor_code, created_at, is_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            platform_order_id=excluded.platform_order_id,
+            status=excluded.status,
+            order_type=excluded.order_type,
+            vendor_code=excluded.vendor_code,
+            created_at=excluded.created_at,
+            is_active=excluded.is_active
+        """,
+        rows,
+    )
+    # Liniile comenzilor primite sunt rescrise în bloc
+    conn.execute("DELETE FROM order_items WHERE order_id IN (SELECT id FROM sync_order_ids)")
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO order_items (order_id, line_no, user_id, credential_id, sku, name, qty, price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        item_rows,
+    )
+
+    # Pas 4: ștergerea (întâi liniile, apoi comenzile)
+    conn.execute("DELETE FROM order_items WHERE order_id IN (SELECT id FROM sync_removed_ids)")
+    deleted = conn.execute(
+        "DELETE FROM orders WHERE id IN (SELECT id FROM sync_removed_ids) AND user_id = ? AND credential_id = ?",
+        (user_id, cred_id),
+    ).rowcount
+
+    # ...și adăugăm contribuția comenzilor scrise acum
+    apply_sku_demand(conn, 1, "o.id IN (SELECT id FROM sync_order_ids)")
+    conn.execute(
+        "DELETE FROM sku_demand WHERE user_id = ? AND credential_id = ? AND lines <= 0",
+        (user_id, cred_id),
+    )
+    conn.execute("DELETE FROM sync_order_ids")
+    conn.execute("DELETE FROM sync_removed_ids")
+
+    inserted = received - updated
+    print(f"[REFRESH] {inserted} inserted, {updated} updated, {deleted} deleted")
+
+    now_iso = datetime.now().isoformat()
+    conn.execute(
+        "UPDATE credentials SET last_sync = ?, sync_status = 'ok', sync_error = NULL WHERE id = ? AND user_id = ?",
+        (now_iso, cred_id, user_id),
+    )
+    if platform == 2:
+        # Watermark = momentul până la care am văzut modificările (endDate al cererii)
+        conn.execute(
+            """
+            UPDATE credentials
+            SET sync_watermark = ?, last_full_sync = CASE WHEN ? = 'full' THEN ? ELSE last_full_sync END
+            WHERE id = ? AND user_id = ?
+            """,
+            (sync_end_ms, sync_mode, now_iso, cred_id, user_id),
+        )
+
+    return {
+        "orders_fetched": len(new_orders),
+        "sync_mode": sync_mode,
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": deleted,
+    }
+
+
+async def sync_credential_orders(user_id, cred_d, full_sync=False):
+    """Preia comenzile unui credential de la marketplace și actualizează tabela orders"""
+    if cred_d.get("platform", 1) == 3:
+        # Oblio - nu are comenzi, este doar pentru facturi/stocuri
+        print(f"[REFRESH] Platform 3 (Oblio) does not support orders - skipping")
+        return {"message": "Oblio does not support orders", "orders_count": 0}
+
+    # Un singur sync per credential odată (manual, refresh-all sau scheduler)
+    async with credential_sync_lock(cred_d["id"]):
+        try:
+            await set_sync_status(cred_d["id"], "running")
+            result = await fetch_credential_orders(cred_d, full_sync=full_sync)
+            stored = await db.write(store_credential_orders, user_id, cred_d, result)
+            print(f"[REFRESH] Complete ({stored['sync_mode']}). Fetched {stored['orders_fetched']} orders")
+            return {**stored, "message": "Refresh complete"}
+        except HTTPException as e:
+            await set_sync_status(cred_d["id"], "error", e.detail)
+            raise
+        except Exception as e:
+            await set_sync_status(cred_d["id"], "error", str(e))
+            print(f"[REFRESH] Exception occurred: {type(e).__name__}: {e}")
+            import traceback
+            traceback.print_exc()
+            return {"error": str(e)}
+
+
+credential_sync_locks = {}  # credential_id -> asyncio.Lock
 
-@app.post("/orders/refresh")
-async def refresh_orders(request: Request):
-    print(f"[REFRESH] Refresh request started")
-    user = get_current_user(request)
 
+def credential_sync_lock(cred_id):
+    lock = credential_sync_locks.get(cred_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        credential_sync_locks[cred_id] = lock
+    return lock
+
+
+async def set_sync_status(cred_id, status, error=None):
+    """Starea ultimului sync (running / ok / error), salvată lângă credentials.last_sync"""
+    await db.execute(
+        "UPDATE credentials SET sync_status = ?, sync_error = ? WHERE id = ?",
+        (status, error, cred_id),
+    )
+
+
+# Platformele care au comenzi (eMAG RO/HU/BG, Trendyol) și câte sync-uri rulează simultan per platformă
+ORDER_PLATFORMS = (1, 2)
+REFRESH_ALL_CONCURRENCY = {
+    1: EMAG_REFRESH_CONCURRENCY,
+    2: TRENDYOL_REFRESH_CONCURRENCY,
+}
+
+
+@app.post("/orders/refresh-all")
+async def refresh_all_orders(request: Request):
+    """
+    Sincronizează toate credențialele cu comenzi ale userului în paralel (limitat per platformă)
+    și scrie rezultatele într-o singură tranzacție. Returnează timpii și numărul de comenzi
+    per credential.
+    """
+    user = await get_current_user(request)
     try:
         request_body = await request.json()
     except Exception:
         request_body = {}
+    full_sync = bool(request_body.get("full_sync"))
 
-    print(f"[REFRESH] Request data: {request_body}")
-    cred_id = request_body.get("credential_id")
-    print(f"[REFRESH] Looking for credential ID: {cred_id}")
-
-    cur = conn.execute(
-        "SELECT * FROM credentials WHERE id = ? AND user_id = ?",
-        (cred_id, user["id"]),
+    cur = await db.query(
+        f"SELECT * FROM credentials WHERE user_id = ? AND platform IN ({','.join('?' * len(ORDER_PLATFORMS))}) ORDER BY id",
+        (user["id"], *ORDER_PLATFORMS),
     )
-    cred = cur.fetchone()
+    creds = [row_to_dict(r) for r in cur.fetchall()]
+    print(f"[REFRESH] Refresh-all started for {len(creds)} credentials")
 
-    if not cred:
-        print(f"[REFRESH] Credential not found")
-        raise HTTPException(status_code=404, detail="Credential not found")
+    started = time.monotonic()
+    semaphores = {p: asyncio.Semaphore(max(1, n)) for p, n in REFRESH_ALL_CONCURRENCY.items()}
+    # Lock-urile credențialelor reușite rămân luate până se termină tranzacția de scriere,
+    # altfel un sync (scheduler / refresh manual) scris între timp ar fi suprascris cu date mai vechi.
+    # Pe orice altă cale (eroare, excepție din set_sync_status, anulare) fetch_one își eliberează singur lock-ul.
+    held_locks = []
 
-    cred_d = row_to_dict(cred)
-    platform = cred_d.get("platform", 1)
-    print(f"[REFRESH] Using platform: {platform}")
+    def new_report(cred_d):
+        return {
+            "credential_id": cred_d["id"],
+            "account_label": cred_d.get("account_label"),
+            "platform": cred_d.get("platform"),
+        }
+
+    async def fetch_one(cred_d):
+        report = new_report(cred_d)
+        lock = credential_sync_lock(cred_d["id"])
+        async with semaphores[cred_d["platform"]]:
+            await lock.acquire()
+            result = None
+            try:
+                fetch_started = time.monotonic()
+                try:
+                    await set_sync_status(cred_d["id"], "running")
+                    result = await fetch_credential_orders(cred_d, full_sync=full_sync)
+                except Exception as e:
+                    print(f"[REFRESH] Credential {cred_d['id']} failed: {type(e).__name__}: {e}")
+                    result = None
+                    report["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+                    await set_sync_status(cred_d["id"], "error", report["error"])
+                report["fetch_ms"] = round((time.monotonic() - fetch_started) * 1000)
+            finally:
+                if result is not None:
+                    held_locks.append(lock)
+                else:
+                    lock.release()
+        return report, result
 
     try:
-        if platform == 1:
-            print(f"[REFRESH] Fetching EMAG orders")
-            client = EMAGClient(
-                client_id=cred_d["client_id"],
-                client_secret=cred_d.get("client_secret", ""),
-                vendor_code=cred_d["vendor_code"],
-                account_label=cred_d.get("account_label", ""),
-            )
-            # DOAR comenzi noi (1) și in progress (2)
-            print(f"[REFRESH][EMAG] Fetching ONLY 'new' (1) and 'in progress' (2) orders")
-            new_orders = await client.fetch_orders(statuses=[1, 2])
-        elif platform == 2:
-            print(f"[REFRESH] Fetching Trendyol orders")
+        # return_exceptions: gather-ul se termină abia după ce toate task-urile s-au terminat,
+        # deci niciun fetch_one nu mai poate lua un lock după eliberarea din finally
+        outcomes = await asyncio.gather(*(fetch_one(c) for c in creds), return_exceptions=True)
+        fetched = []
+        for cred_d, outcome in zip(creds, outcomes):
+            if isinstance(outcome, BaseException):
+                print(f"[REFRESH] Credential {cred_d['id']} failed: {type(outcome).__name__}: {outcome}")
+                outcome = ({**new_report(cred_d), "error": str(outcome)}, None)
+            fetched.append(outcome)
+
+        # O singură tranzacție pentru toate credențialele reușite; cele eșuate rămân neatinse
+        write_started = time.monotonic()
+
+        def store_all(conn):
+            reports = []
+            for cred_d, (report, result) in zip(creds, fetched):
+                if result is not None:
+                    store_started = time.monotonic()
+                    report.update(store_credential_orders(conn, user["id"], cred_d, result))
+                    report["store_ms"] = round((time.monotonic() - store_started) * 1000)
+                reports.append(report)
+            return reports
+
+        try:
+            reports = await db.write(store_all)
+        except Exception as e:
+            print(f"[REFRESH] Refresh-all write failed: {type(e).__name__}: {e}")
+            import traceback
+            traceback.print_exc()
+            # Tranzacția s-a anulat, deci nici credențialele reușite la fetch nu au fost salvate
+            for cred_d, (report, result) in zip(creds, fetched):
+                if result is not None:
+                    await set_sync_status(cred_d["id"], "error", str(e))
+            return {"error": str(e), "credentials": [r for r, _ in fetched]}
+    finally:
+        for lock in held_locks:
+            lock.release()
+
+    total_ms = round((time.monotonic() - started) * 1000)
+    failed = sum(1 for r in reports if "error" in r)
+    print(f"[REFRESH] Refresh-all complete in {total_ms}ms ({failed} failed)")
+    return {
+        "credentials": reports,
+        "orders_fetched": sum(r.get("orders_fetched", 0) for r in reports),
+        "failed": failed,
+        "write_ms": round((time.monotonic() - write_started) * 1000),
+        "total_ms": total_ms,
+        "message": "Refresh complete",
+    }
+
+
+class SyncScheduler:
+    """
+    Sync automat al comenzilor în fundal, pornit din lifespan. La fiecare rundă (SYNC_INTERVAL ± jitter)
+    sincronizează credențialele cu comenzi care nu au mai fost sincronizate în ultimele SYNC_MIN_AGE
+    secunde, cu aceleași limite per platformă ca refresh-all și fără două sync-uri simultane pe
+    același credential. Astfel GET /orders rămâne o citire locală.
+    """
+
+    def __init__(self, interval, jitter, min_age):
+        self.interval = interval
+        self.jitter = jitter
+        self.min_age = min_age
+        self._task = None
+        self.runs = 0
+        self.synced = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_run = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            print(f"[SYNC] Scheduler started (interval {self.interval}s, jitter {self.jitter:.0%})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
             try:
-                client = TrendyolClient(
-                    supplier_id=cred_d.get("vendor_code") or cred_d.get("client_id"),
-                    api_key=cred_d.get("client_id"),
-                    api_secret=cred_d.get("client_secret", ""),
-                    account_label=cred_d.get("account_label", ""),
-                )
-                print(f"[REFRESH] TrendyolClient created successfully")
-                
-                # Preluăm comenzile noi, în procesare și cele cu factură în așteptare
-                status_list = [
-                    "Created",          # Comenzi noi
-                    "Picking",          # În procesare/pregătire
-                    "Invoiced",         # Cu factură (invoice pending)
-                ]
-                print(f"[REFRESH][TRENDYOL] Fetching 'Created', 'Picking' and 'Invoiced' orders")
-                new_orders = []
-                
-                print(f"[REFRESH][TRENDYOL] Fetching ALL orders without date filters")
-                for status in status_list:
-                    print(f"[REFRESH] Fetching {status} orders...")
-                    page = 0
-                    max_pages = 100  # Limita de siguranță pentru pagini
-                    while page < max_pages:
-                        # Fără filtre de dată - preia toate comenzile pentru acest status
-                        orders, total_pages, total_elements = await client.fetch_orders(
-                            status=status, page=page, size=200
-                        )
-                        if not orders:
-                            print(f"[REFRESH] No more orders for status {status} at page {page}")
-                            break
-                        new_orders.extend(orders)
-                        print(f"[REFRESH] Got {len(orders)} orders status {status} page {page + 1}/{total_pages} (total elements: {total_elements})")
-                        page += 1
-                        # Dacă am ajuns la ultima pagină, oprim
-                        if page >= total_pages:
-                            print(f"[REFRESH] Reached last page ({total_pages}) for status {status}")
-                            break
-            except Exception as trendyol_error:
-                print(f"[REFRESH] Trendyol error: {trendyol_error}")
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _next_delay(self):
+        return max(1.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    async def _loop(self):
+        delay = SYNC_STARTUP_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"[SYNC] Scheduler run failed: {type(e).__name__}: {e}")
                 import traceback
                 traceback.print_exc()
-                new_orders = []
-        elif platform == 3:
-            # Oblio - nu are comenzi, este doar pentru facturi/stocuri
-            print(f"[REFRESH] Platform 3 (Oblio) does not support orders - skipping")
-            return {"message": "Oblio does not support orders", "orders_count": 0}
-        else:
-            print(f"[REFRESH] Unknown platform: {platform}")
-            raise HTTPException(status_code=400, detail=f"Unknown platform: {platform}")
+            delay = self._next_delay()
 
-        print(f"[REFRESH] Got {len(new_orders)} orders, updating database")
-        
-        # Pas 1: Colectăm ID-urile comenzilor care trebuie să rămână
-        new_order_ids = set()
-        for order in new_orders:
-            order_id = f"{order['order_id']}-{cred_id}"
-            new_order_ids.add(order_id)
-            items_json = json.dumps(order.get("items", []))
-            conn.execute(
-                """
-                INSERT INTO orders (id, user_id, credential_id, platform_order_id, status, order_type, vendor_code, created_at, items)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ON CONFLICT(id) DO UPDATE SET
-                    platform_order_id=excluded.platform_order_id,
-                    status=excluded.status,
-                    order_type=excluded.order_type,
-                    vendor_code=excluded.vendor_code,
-                    created_at=excluded.created_at,
-                    items=excluded.items
-                """,
-                (
-                    order_id,
-                    user["id"],
-                    cred_id,
-                    order["order_id"],
-                    order.get("status"),
-                    order.get("order_type"),
-                    order.get("vendor_code"),
-                    order.get("created_at"),
-                    items_json,
-                ),
-            )
-        
-        # Pas 2: Ștergem comenzile vechi care nu mai sunt în lista nouă
-        # (înseamnă că au fost procesate și nu mai sunt "new" sau "in progress")
-        if new_order_ids:
-            # Găsim comenzile vechi pentru acest credential
-            cur = conn.execute(
-                "SELECT id FROM orders WHERE user_id = ? AND credential_id = ?",
-                (user["id"], cred_id),
-            )
-            old_order_ids = {row[0] for row in cur.fetchall()}
-            
-            # Comenzile care trebuie șterse = comenzi vechi care nu sunt în lista nouă
-            orders_to_delete = old_order_ids - new_order_ids
-            
-            if orders_to_delete:
-                print(f"[REFRESH] Deleting {len(orders_to_delete)} old/processed orders")
-                for old_id in orders_to_delete:
-                    conn.execute(
-                        "DELETE FROM orders WHERE id = ? AND user_id = ? AND credential_id = ?",
-                        (old_id, user["id"], cred_id),
-                    )
-        else:
-            # Dacă nu sunt comenzi noi, ștergem TOATE comenzile vechi pentru acest credential
-            print(f"[REFRESH] No new orders found, deleting all old orders for this credential")
-            conn.execute(
-                "DELETE FROM orders WHERE user_id = ? AND credential_id = ?",
-                (user["id"], cred_id),
-            )
-        
-        conn.execute(
-            "UPDATE credentials SET last_sync = ? WHERE id = ? AND user_id = ?",
-            (datetime.now().isoformat(), cred_id, user["id"]),
+    def _is_due(self, cred_d):
+        if credential_sync_lock(cred_d["id"]).locked():
+            return False  # deja în sync (manual sau refresh-all)
+        last_sync = cred_d.get("last_sync")
+        if not last_sync:
+            return True
+        try:
+            age = (datetime.now() - datetime.fromisoformat(last_sync)).total_seconds()
+        except ValueError:
+            return True
+        return age >= self.min_age
+
+    async def run_once(self):
+        """O rundă de sync pentru toate credențialele scadente (toți userii)"""
+        self.runs += 1
+        self.last_run = datetime.now().isoformat()
+        cur = await db.query(
+            f"SELECT * FROM credentials WHERE platform IN ({','.join('?' * len(ORDER_PLATFORMS))}) ORDER BY id",
+            ORDER_PLATFORMS,
         )
-        conn.commit()
-        print(f"[REFRESH] Complete. Fetched {len(new_orders)} orders")
-        return {"orders_fetched": len(new_orders), "message": "Refresh complete"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"[REFRESH] Exception occurred: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"error": str(e)}
+        creds = [row_to_dict(r) for r in cur.fetchall()]
+        due = [c for c in creds if self._is_due(c)]
+        self.skipped += len(creds) - len(due)
+        if not due:
+            return
+        print(f"[SYNC] Syncing {len(due)} credentials ({len(creds) - len(due)} skipped)")
+        semaphores = {p: asyncio.Semaphore(max(1, n)) for p, n in REFRESH_ALL_CONCURRENCY.items()}
+
+        async def sync_one(cred_d):
+            async with semaphores[cred_d["platform"]]:
+                # Jitter suplimentar per credential ca să nu pornească toate în aceeași secundă
+                await asyncio.sleep(random.uniform(0, min(5.0, self.interval * self.jitter)))
+                result = await single_flight.do(
+                    (cred_d["user_id"], cred_d["id"], "refresh", False),
+                    lambda: sync_credential_orders(cred_d["user_id"], cred_d),
+                )
+                if "error" in result:
+                    self.failed += 1
+                else:
+                    self.synced += 1
+
+        results = await asyncio.gather(*(sync_one(c) for c in due), return_exceptions=True)
+        for cred_d, result in zip(due, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                print(f"[SYNC] Credential {cred_d['id']} failed: {type(result).__name__}: {result}")
+
+    def stats(self):
+        return {
+            "enabled": self._task is not None,
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "min_age": self.min_age,
+            "runs": self.runs,
+            "synced": self.synced,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "last_run": self.last_run,
+        }
+
+
+sync_scheduler = SyncScheduler(SYNC_INTERVAL, SYNC_JITTER, SYNC_MIN_AGE)
+
+
+@app.get("/admin/sync")
+async def get_sync_status(request: Request):
+    """Starea scheduler-ului și a ultimului sync pentru fiecare credential al userului"""
+    user = await get_current_user(request)
+    cur = await db.query(
+        "SELECT id, account_label, platform, last_sync, sync_status, sync_error FROM credentials WHERE user_id = ? ORDER BY id",
+        (user["id"],),
+    )
+    return {
+        "scheduler": sync_scheduler.stats(),
+        "credentials": [row_to_dict(r) for r in cur.fetchall()],
+    }
 
 
 @app.post("/emag/product/price")
 async def get_emag_product_price(request: Request, data: dict):
     """Preluează prețul unui produs de pe eMAG folosind SKU"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     sku = data.get("sku")
     credential_id = data.get("credential_id")
     
@@ -1443,7 +3746,7 @@ async def get_emag_product_price(request: Request, data: dict):
         raise HTTPException(status_code=400, detail="credential_id is required")
     
     # Găsim credențialele eMAG pentru user
-    cur = conn.execute(
+    cur = await db.query(
         "SELECT * FROM credentials WHERE id = ? AND user_id = ? AND platform = 1",
         (credential_id, user["id"])
     )
@@ -1469,6 +3772,8 @@ async def get_emag_product_price(request: Request, data: dict):
         
         return {"price": price}
     
+    except CircuitOpenError as e:
+        return {"price": None, "message": str(e)}
     except Exception as e:
         print(f"[ERROR] Error fetching EMAG product price: {e}")
         import traceback
@@ -1476,75 +3781,356 @@ async def get_emag_product_price(request: Request, data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/calculator/products")
-async def get_calculator_products(request: Request):
-    """Preluează produsele și setările calculatorului pentru user"""
-    user = get_current_user(request)
-    
-    cur = conn.execute(
-        "SELECT * FROM calculator_products WHERE user_id = ?",
-        (user["id"],)
-    )
-    row = cur.fetchone()
-    
-    if not row:
-        return {
-            "products": [],
-            "electricity_settings": {
-                "printerConsumption": 0.12,
-                "electricityCost": 1.11
-            },
-            "marketplace_settings": [],
-            "manual_products": []
-        }
-    
-    row_dict = row_to_dict(row)
-    products = json.loads(row_dict.get("products", "[]"))
-    electricity_settings = json.loads(row_dict.get("electricity_settings", "{}")) if row_dict.get("electricity_settings") else {
-        "printerConsumption": 0.12,
-        "electricityCost": 1.11
+@app.get("/admin/cache")
+async def get_cache_stats(request: Request):
+    """Statistici pentru cache-urile de oferte eMAG și stoc Oblio (hit/miss, dimensiune)"""
+    await get_current_user(request)
+    return {
+        "emag_offers": emag_offer_cache.stats(),
+        "emag_offer_index": emag_offer_index.stats(),
+        "oblio_stock": oblio_stock_cache.stats(),
+        "single_flight": single_flight.stats(),
     }
-    marketplace_settings = json.loads(row_dict.get("marketplace_settings", "[]")) if row_dict.get("marketplace_settings") else []
-    manual_products = json.loads(row_dict.get("manual_products", "[]")) if row_dict.get("manual_products") else []
-    
+
+
+@app.get("/admin/breakers")
+async def get_breakers(request: Request):
+    """Starea circuit breaker-elor și a rate limiter-elor pentru credențialele userului"""
+    user = await get_current_user(request)
+    cur = await db.query(
+        "SELECT * FROM credentials WHERE user_id = ? ORDER BY id ASC", (user["id"],)
+    )
+    results = []
+    for cred_d in (row_to_dict(r) for r in cur.fetchall()):
+        try:
+            client = client_for_credential(cred_d)
+        except ValueError:
+            continue
+        key = (client.PLATFORM, client.credential_key)
+        breaker = circuit_breakers.get(key)
+        limiter = rate_limiters.get(key)
+        results.append({
+            "credential_id": cred_d["id"],
+            "account_label": cred_d["account_label"],
+            "platform": client.PLATFORM,
+            "breaker": breaker.stats() if breaker else {"state": CircuitBreaker.CLOSED},
+            "rate_limit": limiter.stats() if limiter else None,
+        })
+    return results
+
+
+@app.post("/admin/breakers/{cred_id}/reset")
+async def reset_breaker(cred_id: int, request: Request):
+    """Închide manual breaker-ul unui credential (ex. după ce upstream-ul și-a revenit)"""
+    user = await get_current_user(request)
+    cur = await db.query(
+        "SELECT * FROM credentials WHERE id = ? AND user_id = ?", (cred_id, user["id"])
+    )
+    cred = cur.fetchone()
+    if not cred:
+        raise HTTPException(status_code=404, detail="Credential not found")
+    client = client_for_credential(row_to_dict(cred))
+    breaker = circuit_breakers.get((client.PLATFORM, client.credential_key))
+    if breaker:
+        breaker.reset()
+    return {"credential_id": cred_id, "state": CircuitBreaker.CLOSED}
+
+
+@app.post("/admin/cache/invalidate")
+async def invalidate_cache(request: Request, data: dict):
+    """
+    Invalidează snapshot-urile de ofertă eMAG ale userului
+    Request body: {"credential_id": 1} (opțional - fără el se invalidează toate credențialele eMAG)
+    """
+    user = await get_current_user(request)
+    credential_id = data.get("credential_id")
+    if credential_id:
+        cur = await db.query(
+            "SELECT * FROM credentials WHERE id = ? AND user_id = ? AND platform = 1",
+            (credential_id, user["id"])
+        )
+    else:
+        cur = await db.query(
+            "SELECT * FROM credentials WHERE user_id = ? AND platform = 1",
+            (user["id"],)
+        )
+    creds = [row_to_dict(r) for r in cur.fetchall()]
+    if credential_id and not creds:
+        raise HTTPException(status_code=404, detail="eMAG credential not found")
+
+    removed = 0
+    for cred_d in creds:
+        client = EMAGClient(
+            client_id=cred_d.get("client_id", ""),
+            client_secret=cred_d.get("client_secret", ""),
+            vendor_code=cred_d.get("vendor_code", ""),
+            account_label=cred_d.get("account_label", ""),
+        )
+        removed += emag_offer_cache.invalidate(prefix=client.credential_key)
+        emag_offer_index.invalidate(client.credential_key)
+
+    return {"invalidated": removed, "credentials": len(creds)}
+
+
+DEFAULT_ELECTRICITY_SETTINGS = {
+    "printerConsumption": 0.12,
+    "electricityCost": 1.11
+}
+
+
+def read_calculator_data(conn, user_id):
+    row = conn.execute("SELECT * FROM calculator_products WHERE user_id = ?", (user_id,)).fetchone()
+    products, versions = load_calculator_products(conn, user_id)
+    row_dict = row_to_dict(row) if row else {}
+    electricity_settings = json.loads(row_dict["electricity_settings"]) if row_dict.get("electricity_settings") else dict(DEFAULT_ELECTRICITY_SETTINGS)
+    marketplace_settings = json.loads(row_dict["marketplace_settings"]) if row_dict.get("marketplace_settings") else []
+    manual_products = json.loads(row_dict["manual_products"]) if row_dict.get("manual_products") else []
     return {
         "products": products,
         "electricity_settings": electricity_settings,
         "marketplace_settings": marketplace_settings,
-        "manual_products": manual_products
+        "manual_products": manual_products,
+        "versions": versions
+    }
+
+
+def replace_calculator_products(conn, user_id, products, settings):
+    """PUT: lista primită devine lista completă; se rescriu doar produsele schimbate"""
+    current = load_calculator_rows(conn, user_id)
+    versions = {}
+    for position, product in enumerate(products):
+        key = calculator_product_key(product, position)
+        if key in versions:
+            raise HTTPException(status_code=400, detail=f"Duplicate product key: {key}")
+        versions[key] = write_calculator_product(conn, user_id, key, product, position, current.get(key))
+    delete_calculator_products(conn, user_id, [key for key in current if key not in versions])
+    save_calculator_settings(conn, user_id, settings)
+    return versions
+
+
+def patch_calculator_products(conn, user_id, upserts, deletes, expected, settings):
+    """
+    PATCH: aplică upsert-urile și ștergerile într-o singură tranzacție.
+    expected[key] = versiunea văzută de client (0 = produsul nu trebuie să existe încă);
+    la orice nepotrivire nu se scrie nimic și se întoarce 409 cu versiunile curente.
+    """
+    keys = [key for key, _ in upserts] + deletes
+    current = load_calculator_rows(conn, user_id, keys)
+    conflicts = {
+        key: current[key]["version"] if key in current else 0
+        for key in keys
+        if key in expected and expected[key] != (current[key]["version"] if key in current else 0)
+    }
+    if conflicts:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Calculator products were changed by another session", "conflicts": conflicts}
+        )
+
+    next_position = conn.execute(
+        "SELECT COALESCE(MAX(position), -1) + 1 FROM calculator_items WHERE user_id = ?", (user_id,)
+    ).fetchone()[0]
+    versions = {}
+    for key, product in upserts:
+        row = current.get(key)
+        if row:
+            position = row["position"]
+        else:
+            position = next_position
+            next_position += 1
+        versions[key] = write_calculator_product(conn, user_id, key, product, position, row)
+    delete_calculator_products(conn, user_id, deletes)
+    save_calculator_settings(conn, user_id, settings)
+    return {"versions": versions, "deleted": [key for key in deletes if key in current]}
+
+
+CALCULATOR_DEFAULTS = {"printerConsumption": 0.12, "electricityCost": 1.11, "targetPrintRate": 22.0}
+CALCULATOR_METRICS = ("electricity", "printPerHour", "bestPrice", "targetPerHour", "profitPerPiece", "profitPerHour")
+
+
+def _calc_number(value, default):
+    """Valoarea numerică a unui câmp; null / lipsă / nenumeric / NaN / infinit -> default (ca în calculateRow)"""
+    if value is None:
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    return number if math.isfinite(number) else default
+
+
+def calculator_settings(settings):
+    """Setările efective: printerConsumption / electricityCost / targetPrintRate 0 sau lipsă -> implicit"""
+    return {
+        name: _calc_number(settings.get(name), default) or default
+        for name, default in CALCULATOR_DEFAULTS.items()
+    }
+
+
+def compute_calculator_metrics(products, scenarios):
+    """
+    Aceleași formule ca calculateRow din ProductivityCalculatorPage, pentru toate produsele deodată.
+    Fiecare produs devine una sau mai multe linii de print (produs simplu = 1 linie, multi-part = o linie
+    per parte), stocate contiguu; sumele per produs se fac cu np.add.reduceat pe offset-urile liniilor.
+    scenarios = listă de setări (vezi calculator_settings); întoarce {metrică: array (scenarii x produse)}.
+    """
+    count = len(products)
+    starts = []
+    print_time = []
+    stack_size = []
+    cost_material = []
+    multi = np.zeros(count, dtype=bool)
+    packaging = np.zeros(count)
+    pret_emag = np.zeros(count)
+    # NaN = targetPerHour null -> se folosește targetPrintRate din scenariu
+    target = np.full(count, np.nan)
+
+    for i, product in enumerate(products):
+        starts.append(len(print_time))
+        parts = product.get("parts")
+        if product.get("isMultipleParts") and isinstance(parts, list) and parts:
+            multi[i] = True
+            lines = [part if isinstance(part, dict) else {} for part in parts]
+        else:
+            lines = [product]
+        for line in lines:
+            print_time.append(_calc_number(line.get("printTime"), 0.0))
+            stack_size.append(_calc_number(line.get("stackSize"), 1.0))
+            cost_material.append(_calc_number(line.get("costMaterial"), 0.0))
+        packaging[i] = _calc_number(product.get("packagingCost"), 0.0)
+        pret_emag[i] = _calc_number(product.get("pretEmag"), 0.0)
+        # În frontend lipsa cheii înseamnă valoarea implicită 22, iar null setarea globală
+        target[i] = _calc_number(product["targetPerHour"], np.nan) if "targetPerHour" in product else 22.0
+
+    if not count:
+        return {name: np.zeros((len(scenarios), 0)) for name in CALCULATOR_METRICS}
+
+    starts = np.array(starts, dtype=np.intp)
+    print_time = np.array(print_time)
+    stack_size = np.array(stack_size)
+    cost_material = np.array(cost_material)
+
+    # Metrici per linie, independente de setări
+    has_time = print_time > 0
+    has_stack = stack_size > 0
+    safe_time = np.where(has_time, print_time, 1.0)
+    safe_stack = np.where(has_stack, stack_size, 1.0)
+    line_print_per_hour = np.where(has_time, stack_size * 60 / safe_time, 0.0)
+    print_hours = np.where(has_time, print_time / 60, 0.0)
+    hours_per_piece = np.where(has_stack, print_hours / safe_stack, 0.0)
+    material_per_piece = np.where(has_stack, cost_material / safe_stack, 0.0)
+    time_per_piece = np.where(has_stack, print_time / safe_stack, 0.0)
+    # target / printPerHour pe linie = target * (1 / printPerHour), iar target e constant per produs
+    inverse_print_per_hour = np.where(
+        line_print_per_hour > 0, 1 / np.where(line_print_per_hour > 0, line_print_per_hour, 1.0), 0.0
+    )
+
+    # Sume per produs
+    valid = np.add.reduceat((has_time | (cost_material > 0)).astype(np.int32), starts) > 0
+    total_time_per_piece = np.add.reduceat(time_per_piece, starts)
+    total_hours_per_piece = np.add.reduceat(hours_per_piece, starts)
+    total_material = np.add.reduceat(material_per_piece, starts)
+    total_inverse_pph = np.add.reduceat(inverse_print_per_hour, starts)
+
+    # Multi-part: părțile se printează secvențial -> 60 / Σ(timp per piesă)
+    multi_print_per_hour = np.where(
+        total_time_per_piece > 0, 60 / np.where(total_time_per_piece > 0, total_time_per_piece, 1.0), 0.0
+    )
+    print_per_hour = np.where(multi, multi_print_per_hour, line_print_per_hour[starts])
+
+    # Setările scenariilor ca vectori coloană (scenarii x 1), broadcast peste produse
+    kwh_cost = np.array([[sc["printerConsumption"] * sc["electricityCost"]] for sc in scenarios])
+    global_target = np.array([[sc["targetPrintRate"]] for sc in scenarios])
+    effective_target = np.where(np.isnan(target), global_target, target)
+
+    electricity_per_piece = total_hours_per_piece * kwh_cost
+    # Produsul simplu afișează electricitatea per print, cel multi-part suma per piesă
+    electricity = np.where(multi, electricity_per_piece, print_hours[starts] * kwh_cost)
+    best_price = effective_target * total_inverse_pph + total_material + electricity_per_piece + packaging
+    profit_per_piece = np.where(
+        pret_emag > 0, pret_emag - total_material - electricity_per_piece - packaging, 0.0
+    )
+    profit_per_hour = profit_per_piece * print_per_hour
+
+    # Multi-part fără nicio parte completată -> totul 0 în afară de target
+    empty = multi & ~valid
+    metrics = {
+        "electricity": electricity,
+        "printPerHour": np.broadcast_to(print_per_hour, electricity.shape),
+        "bestPrice": best_price,
+        "targetPerHour": effective_target,
+        "profitPerPiece": profit_per_piece,
+        "profitPerHour": profit_per_hour,
     }
+    return {
+        name: values if name == "targetPerHour" else np.where(empty, 0.0, values)
+        for name, values in metrics.items()
+    }
+
+
+def _finite(values):
+    return np.where(np.isfinite(values), values, 0.0)
+
+
+def build_calculator_report(products, scenarios):
+    """
+    Rezultatele per scenariu, rotunjite la 2 zecimale ca în tabelul din frontend.
+    Valorile extreme (ex. printTime foarte aproape de 0) pot depăși float-ul; JSON nu acceptă
+    inf / NaN, iar formatNumber din frontend le afișează oricum ca 0.
+    """
+    keys = [calculator_product_key(product, position) for position, product in enumerate(products)]
+    # profitul are sens doar pentru produsele cu pretEmag completat
+    has_price = np.array([_calc_number(p.get("pretEmag"), 0.0) > 0 for p in products], dtype=bool)
+    report = []
+    with np.errstate(over="ignore", invalid="ignore"):
+        metrics = {name: _finite(values) for name, values in compute_calculator_metrics(products, scenarios).items()}
+        for index, settings in enumerate(scenarios):
+            columns = {name: _finite(np.round(values[index], 2)).tolist() for name, values in metrics.items()}
+            profit_per_hour = metrics["profitPerHour"][index]
+            priced = metrics["profitPerPiece"][index][has_price]
+            report.append({
+                "electricity_settings": settings,
+                "results": [
+                    {"key": key, **{name: columns[name][i] for name in CALCULATOR_METRICS}}
+                    for i, key in enumerate(keys)
+                ],
+                "summary": {
+                    "total_profit_per_hour": float(_finite(np.round(profit_per_hour.sum(), 2))),
+                    "priced_products": int(priced.size),
+                    "unprofitable_products": int((priced <= 0).sum()),
+                },
+            })
+    return report
+
+
+@app.get("/calculator/products")
+async def get_calculator_products(request: Request):
+    """
+    Preluează produsele și setările calculatorului pentru user.
+    versions = {key: versiune} pentru verificarea optimistă din PATCH.
+    """
+    user = await get_current_user(request)
+    return await db.read(read_calculator_data, user["id"])
 
 
 @app.put("/calculator/products")
 async def save_calculator_products(request: Request, data: dict):
-    """Salvează produsele și setările calculatorului pentru user"""
-    user = get_current_user(request)
+    """Salvează produsele și setările calculatorului pentru user (înlocuire completă)"""
+    user = await get_current_user(request)
     products = data.get("products", [])
-    electricity_settings = data.get("electricity_settings", {})
-    marketplace_settings = data.get("marketplace_settings", [])
-    manual_products = data.get("manual_products", [])
-    
-    products_json = json.dumps(products)
-    electricity_settings_json = json.dumps(electricity_settings)
-    marketplace_settings_json = json.dumps(marketplace_settings)
-    manual_products_json = json.dumps(manual_products)
+    if not isinstance(products, list) or not all(isinstance(p, dict) for p in products):
+        raise HTTPException(status_code=400, detail="products must be a list of objects")
+    settings = {
+        "electricity_settings": data.get("electricity_settings", {}),
+        "marketplace_settings": data.get("marketplace_settings", []),
+        "manual_products": data.get("manual_products", [])
+    }
     
     try:
-        conn.execute(
-            """
-            INSERT INTO calculator_products (user_id, products, electricity_settings, marketplace_settings, manual_products)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                products = excluded.products,
-                electricity_settings = excluded.electricity_settings,
-                marketplace_settings = excluded.marketplace_settings,
-                manual_products = excluded.manual_products
-            """,
-            (user["id"], products_json, electricity_settings_json, marketplace_settings_json, manual_products_json)
-        )
-        conn.commit()
-        
-        return {"message": "Products saved successfully"}
+        versions = await db.write(replace_calculator_products, user["id"], products, settings)
+        return {"message": "Products saved successfully", "versions": versions}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Error saving calculator products: {e}")
         import traceback
@@ -1552,7 +4138,91 @@ async def save_calculator_products(request: Request, data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/calculator/compute")
+async def compute_calculator(request: Request, data: Optional[dict] = None):
+    """
+    Calculează bestPrice / profit per piesă / profit pe oră pentru tot setul de produse.
+    Body opțional: {"products": [...] (implicit cele salvate),
+                    "electricity_settings": {...} (suprascrie setările salvate),
+                    "scenarios": [{"electricityCost": 1.4}, ...] (what-if, fiecare peste setările de bază)}
+    """
+    user = await get_current_user(request)
+    data = data or {}
+    stored = await db.read(read_calculator_data, user["id"])
+    products = data.get("products", stored["products"])
+    overrides = data.get("scenarios") or [{}]
+    if not isinstance(products, list) or not all(isinstance(p, dict) for p in products):
+        raise HTTPException(status_code=400, detail="products must be a list of objects")
+    if not isinstance(overrides, list) or not all(isinstance(o, dict) for o in overrides):
+        raise HTTPException(status_code=400, detail="scenarios must be a list of objects")
+
+    base = {**stored["electricity_settings"], **(data.get("electricity_settings") or {})}
+    scenarios = [calculator_settings({**base, **override}) for override in overrides]
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # Calcul CPU-bound: rulează în afara event loop-ului
+    report = await loop.run_in_executor(None, build_calculator_report, products, scenarios)
+    return {
+        "count": len(products),
+        "compute_ms": round((time.perf_counter() - started) * 1000, 1),
+        "scenarios": report
+    }
+
+
+@app.patch("/calculator/products")
+async def patch_calculator_products_endpoint(request: Request, data: dict):
+    """
+    Modificări incrementale ale calculatorului:
+    {"upserts": [produs, ...], "deletes": [key, ...], "versions": {key: versiune văzută},
+     plus opțional electricity_settings / marketplace_settings / manual_products}.
+    Produsele noi se adaugă la final; cele existente își păstrează poziția.
+    """
+    user = await get_current_user(request)
+    upserts = data.get("upserts") or []
+    deletes = [str(key) for key in data.get("deletes") or []]
+    expected = data.get("versions") or {}
+    if not isinstance(upserts, list) or not all(isinstance(p, dict) and p.get("key") not in (None, "") for p in upserts):
+        raise HTTPException(status_code=400, detail="upserts must be a list of products with a key")
+    if not isinstance(expected, dict) or not all(isinstance(v, int) for v in expected.values()):
+        raise HTTPException(status_code=400, detail="versions must map product keys to integers")
+
+    upserts = [(str(p["key"]), p) for p in upserts]
+    keys = [key for key, _ in upserts] + deletes
+    if len(set(keys)) != len(keys):
+        raise HTTPException(status_code=400, detail="Each product key may appear only once per request")
+    settings = {column: data[column] for column in CALCULATOR_SETTINGS if column in data}
+
+    try:
+        return await db.write(
+            patch_calculator_products, user["id"], upserts, deletes, {str(k): v for k, v in expected.items()}, settings
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] Error patching calculator products: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Marketplace Admin API")
+    parser.add_argument(
+        "--check-query-plans",
+        action="store_true",
+        help="verifică cu EXPLAIN QUERY PLAN că interogările frecvente folosesc indexuri și iese",
+    )
+    args = parser.parse_args()
+
+    if args.check_query_plans:
+        problems = check_query_plans(db.writer)
+        print(f"Schema version {schema_version(db.writer)}, {len(HOT_QUERIES)} hot queries checked")
+        for problem in problems:
+            print(f"  FAIL {problem}")
+        raise SystemExit(1 if problems else 0)
+
     import uvicorn
 
     port = int(os.getenv("BACKEND_PORT", "8001"))
@@ -0,0 +1,158 @@
+"""
+Benchmark: motorul vectorizat din compute_calculator_metrics față de calculul rând cu rând
+(aceleași formule ca calculateRow din ProductivityCalculatorPage, portate 1:1 în Python).
+
+Generează un catalog sintetic (o parte din produse multi-part), verifică faptul că ambele
+variante dau aceleași valori și măsoară timpul pentru o serie de scenarii what-if (tarife).
+
+    python bench_calculator.py [--products 10000] [--multi 0.3] [--scenarios 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def make_products(count, multi_ratio, seed=7):
+    rng = random.Random(seed)
+
+    def maybe(value):
+        # Câmpuri necompletate, ca în tabelul din UI
+        return None if rng.random() < 0.05 else value
+
+    products = []
+    for i in range(count):
+        product = {
+            "key": str(1700000000000 + i),
+            "productName": f"Produs {i}",
+            "packagingCost": maybe(round(rng.uniform(0, 3), 2)),
+            "pretEmag": rng.choice([0, round(rng.uniform(10, 200), 2)]),
+            "targetPerHour": rng.choice([None, 18, 22, 30]),
+        }
+        if rng.random() < multi_ratio:
+            product["isMultipleParts"] = True
+            product["parts"] = [
+                {
+                    "key": f"{product['key']}-part-{k}",
+                    "printTime": maybe(rng.randint(10, 600)),
+                    "stackSize": maybe(rng.randint(1, 12)),
+                    "costMaterial": maybe(round(rng.uniform(0.5, 40), 2)),
+                }
+                for k in range(rng.randint(1, 6))
+            ]
+        else:
+            product["isMultipleParts"] = False
+            product["printTime"] = maybe(rng.randint(10, 900))
+            product["stackSize"] = maybe(rng.randint(1, 20))
+            product["costMaterial"] = maybe(round(rng.uniform(0.5, 60), 2))
+        products.append(product)
+    return products
+
+
+def value(record, name, default):
+    return default if record.get(name) is None else record[name]
+
+
+def calculate_row(record, settings):
+    """Portarea directă a calculateRow (fără formatNumber)"""
+    consumption = settings["printerConsumption"]
+    cost = settings["electricityCost"]
+    target = record.get("targetPerHour", 22)
+    target = settings["targetPrintRate"] if target is None else target
+    packaging = value(record, "packagingCost", 0)
+    pret = value(record, "pretEmag", 0)
+
+    if record.get("isMultipleParts") and record.get("parts"):
+        best = material_total = electricity_total = time_total = 0.0
+        valid = False
+        for part in record["parts"]:
+            t = value(part, "printTime", 0)
+            s = value(part, "stackSize", 1)
+            m = value(part, "costMaterial", 0)
+            valid = valid or t > 0 or m > 0
+            time_total += t / s if s > 0 else 0
+            pph = s * 60 / t if t > 0 else 0
+            material = m / s if s > 0 else 0
+            electricity = t / 60 * consumption * cost if t > 0 else 0
+            electricity = electricity / s if s > 0 else 0
+            material_total += material
+            electricity_total += electricity
+            best += (target / pph if pph > 0 else 0) + material + electricity
+        if not valid:
+            return (0.0, 0.0, 0.0, target, 0.0, 0.0)
+        pph = 60 / time_total if time_total > 0 else 0
+        profit = pret - material_total - electricity_total - packaging if pret > 0 else 0
+        return (electricity_total, pph, best + packaging, target, profit, profit * pph)
+
+    t = value(record, "printTime", 0)
+    s = value(record, "stackSize", 1)
+    m = value(record, "costMaterial", 0)
+    electricity = t / 60 * consumption * cost if t > 0 else 0
+    pph = s * 60 / t if t > 0 else 0
+    material = m / s if s > 0 else 0
+    electricity_piece = electricity / s if s > 0 else 0
+    best = (target / pph if pph > 0 else 0) + material + electricity_piece + packaging
+    profit = pret - material - electricity_piece - packaging if pret > 0 else 0
+    return (electricity, pph, best, target, profit, profit * pph)
+
+
+def timed(fn, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--multi", type=float, default=0.3, help="fracția de produse multi-part")
+    parser.add_argument("--scenarios", type=int, default=5, help="număr de tarife de electricitate")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-calc-")
+    os.environ["DB_PATH"] = os.path.join(tmpdir, "bench.db")
+    os.environ["SYNC_SCHEDULER_ENABLED"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import backend_sqlite
+
+    products = make_products(args.products, args.multi)
+    scenarios = [
+        backend_sqlite.calculator_settings({"electricityCost": round(1.11 + 0.1 * i, 2)})
+        for i in range(args.scenarios)
+    ]
+    names = backend_sqlite.CALCULATOR_METRICS
+
+    def row_by_row():
+        return [[calculate_row(p, sc) for p in products] for sc in scenarios]
+
+    def vectorized():
+        return backend_sqlite.compute_calculator_metrics(products, scenarios)
+
+    expected, row_ms = timed(row_by_row, args.repeat)
+    metrics, vector_ms = timed(vectorized, args.repeat)
+    _, report_ms = timed(lambda: backend_sqlite.build_calculator_report(products, scenarios), args.repeat)
+
+    expected = np.array(expected)  # scenarii x produse x metrici
+    actual = np.stack([metrics[name] for name in names], axis=-1)
+    max_diff = float(np.abs(expected - actual).max()) if actual.size else 0.0
+    parts = sum(len(p.get("parts") or []) for p in products)
+    print(f"{args.products} products ({parts} parts), {args.scenarios} scenarios, numpy {np.__version__}")
+    print(f"  row by row : {row_ms:8.1f}ms")
+    print(f"  vectorized : {vector_ms:8.1f}ms  ({row_ms / vector_ms:.1f}x)")
+    print(f"  full report: {report_ms:8.1f}ms  (vectorized + rounding + JSON rows)")
+    print(f"  max abs difference vs row by row: {max_diff:.2e}")
+    if max_diff > 1e-6:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark: latența event loop-ului când accesul SQLite rulează direct pe loop
+față de stratul Database (pool de citire + writer serializat pe thread-uri).
+
+Rulează pe o bază temporară cu aceleași scrieri ca un refresh de comenzi (upsert cu items JSON)
+și citiri ca GET /orders, în timp ce o sondă măsoară cât întârzie un asyncio.sleep(PROBE_INTERVAL).
+
+    python bench_db_loop_lag.py [--orders 5000] [--rounds 5] [--readers 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+PROBE_INTERVAL = 0.005
+
+
+def make_orders(count, round_no):
+    return [
+        (
+            f"{i}-1",
+            1,
+            1,
+            str(i),
+            "new",
+            1,
+            "v",
+            f"2024-01-01 10:{i % 60:02d}:00",
+            json.dumps([
+                {"sku": f"SKU{i % 300}-{k}", "name": f"Produs {k} " * 8, "qty": k + 1, "price": 19.99 + round_no}
+                for k in range(5)
+            ]),
+        )
+        for i in range(count)
+    ]
+
+
+UPSERT_SQL = """
+    INSERT INTO orders (id, user_id, credential_id, platform_order_id, status, order_type, vendor_code, created_at, items)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET status=excluded.status, items=excluded.items
+"""
+SELECT_SQL = "SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC"
+
+
+def write_orders(conn, rows):
+    conn.executemany(UPSERT_SQL, rows)
+
+
+def read_orders(conn):
+    return [json.loads(r["items"]) for r in conn.execute(SELECT_SQL, (1,)).fetchall()]
+
+
+async def probe(stop, lags):
+    """Măsoară întârzierea fiecărui sleep față de intervalul cerut"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((loop.time() - started - PROBE_INTERVAL) * 1000)
+
+
+async def run_workload(mode, db, orders, rounds):
+    stop = asyncio.Event()
+    lags = []
+    probe_task = asyncio.create_task(probe(stop, lags))
+    started = time.perf_counter()
+    for round_no in range(rounds):
+        rows = make_orders(orders, round_no)
+        if mode == "blocking":
+            # Ca înainte: aceeași conexiune, apelată direct din handler-ul async
+            write_orders(db.writer, rows)
+            db.writer.commit()
+            for _ in range(4):
+                read_orders(db.writer)
+            await asyncio.sleep(0)
+        else:
+            await db.write(write_orders, rows)
+            await asyncio.gather(*(db.read(read_orders) for _ in range(4)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    return elapsed, lags
+
+
+def summarize(mode, elapsed, lags):
+    lags = sorted(lags) or [0.0]
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(
+        f"{mode:>9}: total {elapsed:6.2f}s | probes {len(lags):5d} | "
+        f"lag mean {statistics.mean(lags):7.2f}ms  p99 {p99:8.2f}ms  max {lags[-1]:8.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench-db-")
+    os.environ["DB_PATH"] = os.path.join(tmpdir, "bench.db")
+    os.environ["DB_READ_CONNECTIONS"] = str(args.readers)
+    os.environ["SYNC_SCHEDULER_ENABLED"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import backend_sqlite
+
+    db = backend_sqlite.db
+    print(f"SQLite {sqlite3.sqlite_version}, {args.orders} orders x {args.rounds} rounds, {args.readers} readers")
+    for mode in ("blocking", "pool"):
+        elapsed, lags = asyncio.run(run_workload(mode, db, args.orders, args.rounds))
+        summarize(mode, elapsed, lags)
+
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,7 @@ export const ordersAPI = {
   list: (userId, filters = {}) => api.get('/orders', { params: { user_id: userId, ...filters } }),
   get: (id, userId) => api.get(`/orders/${id}`, { params: { user_id: userId } }),
   refresh: (userId, credentialId) => api.post('/orders/refresh', { user_id: userId, credential_id: credentialId }),
+  refreshAll: (userId) => api.post('/orders/refresh-all', { user_id: userId }),
 };
 
 export const emagAPI = {
@@ -55,4 +56,6 @@ export const calculatorAPI = {
     marketplace_settings: marketplaceSettings || [],
     manual_products: manualProducts || []
   }),
+  // changes = { upserts: [produs], deletes: [key], versions: { key: versiune }, ...setări opționale }
+  patchProducts: (changes) => api.patch('/calculator/products', changes),
 };
@@ -418,13 +418,14 @@ export default function OrdersPage() {
     refreshInFlightRef.current = true;
     setLoading(true);
     try {
-      for (const cred of credentials) {
-        try {
-          await ordersAPI.refresh(userId, cred.id);
-        } catch (error) {
-          console.error(`Failed to refresh credential ${cred.id}:`, error);
-        }
+      // Toate conturile se sincronizează în paralel, într-un singur request
+      const response = await ordersAPI.refreshAll(userId);
+      if (response.data?.error) {
+        throw new Error(response.data.error);
       }
+      (response.data?.credentials || [])
+        .filter((result) => result.error)
+        .forEach((result) => console.error(`Failed to refresh credential ${result.credential_id}:`, result.error));
       await loadAllOrders();
       setLastRefreshTime(new Date());
       message.success('Orders refreshed from all marketplaces');
@@ -36,40 +36,59 @@ export default function ProductivityCalculatorPage() {
   const [marketplaceSettings, setMarketplaceSettings] = useState([]); // Store marketplace settings to preserve them
   const [manualProducts, setManualProducts] = useState([]); // Store manual products to preserve them
 
-  // Load products and settings from server on mount
-  useEffect(() => {
-    const loadCalculatorData = async () => {
-      try {
-        setLoading(true);
-        const response = await calculatorAPI.getProducts();
-        const data = response.data;
-        
-        if (data.products && data.products.length > 0) {
-          setProducts(data.products);
-        }
-        
-        if (data.electricity_settings) {
-          setElectricitySettings(data.electricity_settings);
-        }
-        
-        // Preserve marketplace settings and manual products
-        if (data.marketplace_settings) {
-          setMarketplaceSettings(data.marketplace_settings);
-        }
-        if (data.manual_products) {
-          setManualProducts(data.manual_products);
-        }
-      } catch (error) {
-        console.error('Failed to load calculator data:', error);
-        // Fallback to empty state if server fails
-      } finally {
-        setLoading(false);
-      }
+  // Ultima stare confirmată de server: { products: { key: JSON }, versions: { key: versiune }, settings: { coloană: JSON } }
+  // Autosave-ul trimite prin PATCH doar diferențele față de ea.
+  const savedRef = useRef({ products: {}, versions: {}, settings: {} });
+  // Salvările rulează una după alta, ca diferența să fie calculată după răspunsul precedentului
+  const saveQueueRef = useRef(Promise.resolve());
+
+  const rememberSaved = (data) => {
+    const savedProducts = {};
+    (data.products || []).forEach(p => { savedProducts[p.key] = JSON.stringify(p); });
+    savedRef.current = {
+      products: savedProducts,
+      versions: data.versions || {},
+      settings: {
+        electricity_settings: JSON.stringify(data.electricity_settings),
+        marketplace_settings: JSON.stringify(data.marketplace_settings || []),
+        manual_products: JSON.stringify(data.manual_products || []),
+      },
     };
-    
-    loadCalculatorData();
+  };
+
+  // Load products and settings from server
+  const loadCalculatorData = useCallback(async () => {
+    try {
+      setLoading(true);
+      const response = await calculatorAPI.getProducts();
+      const data = response.data;
+      rememberSaved(data);
+      
+      setProducts(data.products || []);
+      
+      if (data.electricity_settings) {
+        setElectricitySettings(data.electricity_settings);
+      }
+      
+      // Preserve marketplace settings and manual products
+      if (data.marketplace_settings) {
+        setMarketplaceSettings(data.marketplace_settings);
+      }
+      if (data.manual_products) {
+        setManualProducts(data.manual_products);
+      }
+    } catch (error) {
+      console.error('Failed to load calculator data:', error);
+      // Fallback to empty state if server fails
+    } finally {
+      setLoading(false);
+    }
   }, []);
 
+  useEffect(() => {
+    loadCalculatorData();
+  }, [loadCalculatorData]);
+
   // Set form initial values when modal opens
   useEffect(() => {
     if (electricityModalVisible && electricityForm) {
@@ -125,27 +144,64 @@ export default function ProductivityCalculatorPage() {
     loadEmagCredentials();
   }, []);
 
-  // Save products to server whenever they change (debounced)
+  // Save changed products to server whenever they change (debounced)
   useEffect(() => {
-    if (!loading && products.length >= 0) {
-      const timeoutId = setTimeout(async () => {
+    if (!loading) {
+      const save = async () => {
+        const saved = savedRef.current;
+        const current = {};
+        products.forEach(p => { current[p.key] = JSON.stringify(p); });
+        const upserts = products.filter(p => saved.products[p.key] !== current[p.key]);
+        const deletes = Object.keys(saved.products).filter(key => !(key in current));
+        const changes = { upserts, deletes, versions: {} };
+        [...upserts.map(p => p.key), ...deletes].forEach(key => {
+          changes.versions[key] = saved.versions[key] || 0;
+        });
+        const settings = {
+          electricity_settings: electricitySettings,
+          marketplace_settings: marketplaceSettings,
+          manual_products: manualProducts,
+        };
+        Object.entries(settings).forEach(([column, value]) => {
+          if (saved.settings[column] !== JSON.stringify(value)) {
+            changes[column] = value;
+          }
+        });
+        if (upserts.length === 0 && deletes.length === 0 && Object.keys(changes).length === 3) {
+          return;
+        }
+
         try {
-          // Preserve marketplace_settings and manual_products when saving
-          await calculatorAPI.saveProducts(
-            products, 
-            electricitySettings,
-            marketplaceSettings,
-            manualProducts
-          );
+          const response = await calculatorAPI.patchProducts(changes);
+          upserts.forEach(p => { saved.products[p.key] = current[p.key]; });
+          deletes.forEach(key => {
+            delete saved.products[key];
+            delete saved.versions[key];
+          });
+          Object.assign(saved.versions, response.data.versions);
+          Object.keys(settings).forEach(column => {
+            if (column in changes) {
+              saved.settings[column] = JSON.stringify(changes[column]);
+            }
+          });
         } catch (error) {
+          if (error.response?.status === 409) {
+            // Alt tab / pagină a modificat aceleași produse - reîncărcăm versiunea de pe server
+            message.warning('Products were changed elsewhere. Reloading the latest version.');
+            loadCalculatorData();
+            return;
+          }
           console.error('Failed to save products to server:', error);
           message.error('Failed to save products. Please try again.');
         }
+      };
+      const timeoutId = setTimeout(() => {
+        saveQueueRef.current = saveQueueRef.current.then(save);
       }, 1000); // Debounce: save 1 second after last change
       
       return () => clearTimeout(timeoutId);
     }
-  }, [products, electricitySettings, marketplaceSettings, manualProducts, loading]);
+  }, [products, electricitySettings, marketplaceSettings, manualProducts, loading, loadCalculatorData]);
 
   const calculateRow = useCallback((record) => {
     const {